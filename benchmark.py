@@ -0,0 +1,456 @@
+from __future__ import annotations
+
+from typing import Optional
+import argparse
+import datetime
+import json
+import os
+import shutil
+import zipfile
+
+import numpy as np
+import polars as pl
+
+import myismn
+
+# flags of the synthetic records and how often a run of observations carries them
+DEFAULT_FLAG_MIX = {
+    "G": 0.80,
+    "M": 0.03,
+    "C01": 0.01,
+    "C02": 0.01,
+    "C03": 0.01,
+    "D01": 0.03,
+    "D02": 0.03,
+    "D03": 0.02,
+    "D06": 0.01,
+    "D07": 0.01,
+    "D08": 0.01,
+    "D09": 0.02,
+    "D10": 0.01,
+}
+
+# typos of the kind found in real downloads, reported in "faulty_flags.txt"
+MALFORMED_FLAGS = ["XYZ", "D1O", "G,", "C0l", "D06;D07"]
+
+DEFAULT_SENSORS = (
+    ("sm", 0.05, 0.05),
+    ("sm", 0.10, 0.10),
+    ("sm", 0.30, 0.30),
+    ("ts", 0.05, 0.05),
+    ("ta", -2.00, -2.00),
+)
+
+# the "<network>_<network>_<station>_static_variables.csv" every ISMN station has,
+# quantity_name;unit;depth_from[m];depth_to[m];value;description;quantity_source_name
+STATIC_VARIABLES = (
+    (
+        "land cover classification",
+        "(unitless)",
+        0.0,
+        0.0,
+        10,
+        "Cropland, rainfed",
+        "CCI_landcover_2010",
+    ),
+    (
+        "climate classification",
+        "(unitless)",
+        0.0,
+        0.0,
+        "Cfb",
+        "Temperate, Without dry season, Warm Summer",
+        "koeppen_geiger_2007",
+    ),
+    ("saturation", "m^3*m^-3", 0.0, 0.3, 0.45, "saturation", "HWSD"),
+    ("clay fraction", "% weight", 0.0, 0.3, 20.0, "clay fraction", "HWSD"),
+    ("sand fraction", "% weight", 0.0, 0.3, 40.0, "sand fraction", "HWSD"),
+    ("silt fraction", "% weight", 0.0, 0.3, 40.0, "silt fraction", "HWSD"),
+    ("organic carbon", "% weight", 0.0, 0.3, 1.2, "organic carbon", "HWSD"),
+)
+
+SCALES = {
+    "small": dict(n_networks=2, n_stations=5, n_hours=24 * 90),
+    "medium": dict(n_networks=5, n_stations=20, n_hours=24 * 365),
+    "large": dict(n_networks=20, n_stations=50, n_hours=24 * 365 * 3),
+}
+
+
+def synthetic_values(
+    variable: str, hours: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """Creates a plausible series for a variable: a seasonal cycle plus noise.
+    :param variable: The variable abbreviation, e.g. "sm"
+    :type variable: str
+    :param hours: Hours since the start of the record
+    :type hours: np.ndarray
+    :param rng: The random generator
+    :type rng: np.random.Generator
+    :return: The values of the series
+    :rtype: np.ndarray
+    """
+    season = np.sin(2 * np.pi * hours / (24 * 365.25))
+    if variable == "sm":
+        return np.clip(0.25 + 0.1 * season + rng.normal(0, 0.02, len(hours)), 0, 0.6)
+    return (
+        10
+        + 15 * season
+        + 5 * np.sin(2 * np.pi * hours / 24)
+        + rng.normal(0, 1, len(hours))
+    )
+
+
+def synthetic_flags(
+    n_rows: int,
+    rng: np.random.Generator,
+    flag_mix: dict,
+    flag_change_rate: float,
+    compound_fraction: float,
+    malformed_fraction: float,
+) -> np.ndarray:
+    """Creates the flag column of a record as runs of equal flags, as in the ISMN \
+        data, some of them compound (e.g. "D01,D02") or malformed.
+    :param n_rows: The number of observations
+    :type n_rows: int
+    :param rng: The random generator
+    :type rng: np.random.Generator
+    :param flag_mix: The relative frequency of every flag
+    :type flag_mix: dict
+    :param flag_change_rate: The probability of a new run starting at an observation
+    :type flag_change_rate: float
+    :param compound_fraction: The fraction of runs combining two flags
+    :type compound_fraction: float
+    :param malformed_fraction: The fraction of runs with a malformed flag
+    :type malformed_fraction: float
+    :return: The flag string of every observation
+    :rtype: np.ndarray
+    """
+    runs = np.cumsum(rng.random(n_rows) < flag_change_rate)
+    n_runs = runs[-1] + 1 if n_rows else 0
+
+    codes = list(flag_mix)
+    p = np.array(list(flag_mix.values()), dtype=float)
+    run_flags = rng.choice(codes, size=n_runs, p=p / p.sum()).astype(object)
+
+    compound = rng.random(n_runs) < compound_fraction
+    run_flags[compound] = [
+        ",".join(sorted(rng.choice(codes[1:], size=2, replace=False)))
+        for _ in range(compound.sum())
+    ]
+    malformed = rng.random(n_runs) < malformed_fraction
+    run_flags[malformed] = rng.choice(MALFORMED_FLAGS, size=malformed.sum())
+
+    return run_flags[runs].astype(str)
+
+
+def make_synthetic_archive(
+    root: str,
+    n_networks: Optional[int] = 3,
+    n_stations: Optional[int] = 10,
+    sensors: Optional[tuple] = DEFAULT_SENSORS,
+    n_hours: Optional[int] = 24 * 365,
+    flag_mix: Optional[dict] = None,
+    flag_change_rate: Optional[float] = 0.05,
+    compound_fraction: Optional[float] = 0.01,
+    malformed_fraction: Optional[float] = 0.001,
+    extent: Optional[tuple] = (-60.0, 75.0, -180.0, 180.0),
+    start: Optional[str] = "2015-01-01",
+    zip_archive: Optional[bool] = False,
+    seed: Optional[int] = 0,
+) -> str:
+    """Writes a synthetic database in the layout of an ISMN download \
+        (<root>/<network>/<station>/<network>_<network>_<station>_<variable>_... .stm), \
+        including the static variables csv of every station.
+    :param root: The database directory, its name being the database name
+    :type root: str
+    :param n_networks: The number of networks, by default 3
+    :type n_networks: Optional[int]
+    :param n_stations: The number of stations per network, by default 10
+    :type n_stations: Optional[int]
+    :param sensors: The (variable, depth from, depth to) of the sensors of every \
+        station, by default three soil moisture, one soil and one air temperature
+    :type sensors: Optional[tuple]
+    :param n_hours: The mean record length in hours, the actual length varies \
+        between half and the full value, by default one year
+    :type n_hours: Optional[int]
+    :param flag_mix: The relative frequency of every flag, by default DEFAULT_FLAG_MIX
+    :type flag_mix: Optional[dict]
+    :param flag_change_rate: The probability of the flag changing between two \
+        observations, by default 0.05
+    :type flag_change_rate: Optional[float]
+    :param compound_fraction: The fraction of flag runs combining two flags, \
+        by default 0.01
+    :type compound_fraction: Optional[float]
+    :param malformed_fraction: The fraction of flag runs with a malformed flag, \
+        by default 0.001
+    :type malformed_fraction: Optional[float]
+    :param extent: The (min_latitude, max_latitude, min_longitude, max_longitude) \
+        the stations are placed in, by default all land latitudes
+    :type extent: Optional[tuple]
+    :param start: The first timestamp of every record, by default "2015-01-01"
+    :type start: Optional[str]
+    :param zip_archive: If True, the database is additionally packed into \
+        "<root>.zip", by default False
+    :type zip_archive: Optional[bool]
+    :param seed: The seed of the random generator, by default 0
+    :type seed: Optional[int]
+    :return: The path of the database, or of the zip archive
+    :rtype: str
+    """
+    rng = np.random.default_rng(seed)
+    flag_mix = flag_mix if flag_mix is not None else DEFAULT_FLAG_MIX
+    min_lat, max_lat, min_lon, max_lon = extent
+    first_hour = np.datetime64(start, "h")
+
+    for n in range(n_networks):
+        network = f"NET{n:03d}"
+        # the stations of a network cluster around a centre, as in reality
+        centre = rng.uniform([min_lat, min_lon], [max_lat, max_lon])
+        for s in range(n_stations):
+            station = f"Station{s:04d}"
+            station_dir = os.path.join(root, network, station)
+            os.makedirs(station_dir, exist_ok=True)
+            latitude, longitude = np.clip(
+                centre + rng.normal(0, 0.5, 2), [min_lat, min_lon], [max_lat, max_lon]
+            )
+            elevation = rng.uniform(0, 2000)
+            with open(
+                os.path.join(
+                    station_dir, f"{network}_{network}_{station}_static_variables.csv"
+                ),
+                "w",
+            ) as csv_file:
+                csv_file.write(
+                    "quantity_name;unit;depth_from[m];depth_to[m];value;description;"
+                    "quantity_source_name\n"
+                )
+                for row in STATIC_VARIABLES:
+                    csv_file.write(";".join(map(str, row)) + "\n")
+
+            for k, (variable, depth_from, depth_to) in enumerate(sensors):
+                n_rows = int(rng.integers(n_hours // 2, n_hours + 1))
+                hours = np.arange(n_rows)
+                timestamps = first_hour + hours
+                sensor_name = f"Probe-{k}"
+                first_day = timestamps[0].astype(datetime.datetime)
+                last_day = timestamps[-1].astype(datetime.datetime)
+                filename = (
+                    f"{network}_{network}_{station}_{variable}_{depth_from:.6f}_"
+                    f"{depth_to:.6f}_{sensor_name}_{first_day:%Y%m%d}_"
+                    f"{last_day:%Y%m%d}.stm"
+                )
+
+                records = pl.DataFrame(
+                    {
+                        "date": timestamps.astype("datetime64[ms]"),
+                        "time": timestamps.astype("datetime64[ms]"),
+                        "value": synthetic_values(variable, hours, rng),
+                        "flag": synthetic_flags(
+                            n_rows,
+                            rng,
+                            flag_mix,
+                            flag_change_rate,
+                            compound_fraction,
+                            malformed_fraction,
+                        ),
+                        "orig_flag": np.full(n_rows, "M"),
+                    }
+                ).with_columns(
+                    pl.col("date").dt.strftime("%Y/%m/%d"),
+                    pl.col("time").dt.strftime("%H:%M"),
+                )
+
+                with open(os.path.join(station_dir, filename), "wb") as stm_file:
+                    stm_file.write(
+                        f"{network:<10} {network:<15} {station:<15} {latitude:10.5f} "
+                        f"{longitude:11.5f} {elevation:7.2f} {depth_from:7.2f} "
+                        f"{depth_to:7.2f}  {sensor_name}\n".encode()
+                    )
+                    records.write_csv(
+                        stm_file, include_header=False, separator=" ", float_precision=4
+                    )
+
+    if not zip_archive:
+        return root
+
+    with zipfile.ZipFile(f"{root}.zip", "w", zipfile.ZIP_DEFLATED) as archive:
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                if filename.endswith((".stm", ".csv")) and directory != root:
+                    # the networks are the top level of an ISMN zip
+                    path = os.path.join(directory, filename)
+                    archive.write(path, os.path.relpath(path, root))
+    return f"{root}.zip"
+
+
+def archive_size(root: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(directory, filename))
+        for directory, _, files in os.walk(root)
+        for filename in files
+        if filename.endswith(".stm")
+    )
+
+
+def run_stages(database: str, n_cores: int) -> dict:
+    """Runs every pipeline stage once on a database from scratch.
+    :param database: The name of the database in the current working directory
+    :type database: str
+    :param n_cores: The number of workers of the stages
+    :type n_cores: int
+    :return: Seconds, throughput and peak memory of every stage
+    :rtype: dict
+    """
+    shutil.rmtree(os.path.join(database, "json_dicts"), ignore_errors=True)
+    n_bytes = archive_size(database)
+    myismn.metrics.reset()
+    myismn.metrics.enable(rss_interval=0.05)
+
+    with myismn.metrics.span("setup"):
+        flags = myismn.Flags(database)
+    n_files = len(flags.get_all_sensors())
+
+    stages = {
+        "get_all_sensors": flags.get_all_sensors,
+        "make_sensor_ids": flags.make_sensor_ids,
+        "get_flag_df": lambda: flags.get_flag_df(n_cores=n_cores),
+        "make_flag_dict": lambda: flags.make_flag_dict(n_cores=n_cores),
+        "geocode_stations": lambda: myismn.Geography.geocode_stations(flags, n_cores),
+    }
+    skipped = set()
+    for stage, run in stages.items():
+        try:
+            with myismn.metrics.span(stage):
+                run()
+        except (ImportError, OSError, RuntimeError) as error:
+            # e.g. GDAL or the TM_WORLD_BORDERS shapefile not being installed
+            print(f'Skipping the stage "{stage}": {error!r}')
+            skipped.add(stage)
+    myismn.metrics.disable()
+
+    results = {}
+    for span in myismn.metrics.spans:
+        if span["path"] in stages and span["path"] not in skipped:
+            results[span["path"]] = {
+                "seconds": span["duration"],
+                "files_per_second": n_files / span["duration"],
+                "mb_per_second": n_bytes / 1024**2 / span["duration"],
+                "peak_rss_mb": span["peak_rss_mb"],
+            }
+    return results
+
+
+def compare_to_baseline(
+    results: dict, baseline: dict, tolerance: Optional[float] = 0.2
+) -> list:
+    """Finds the stages that got slower or use more memory than in the baseline.
+    :param results: The benchmark results, per scale and stage
+    :type results: dict
+    :param baseline: Earlier results, in the same format
+    :type baseline: dict
+    :param tolerance: The accepted relative increase, by default 0.2
+    :type tolerance: Optional[float]
+    :return: A description of every regression
+    :rtype: list
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, measured in stages.items():
+            reference = baseline.get(scale, {}).get(stage)
+            if reference is None:
+                continue
+            for metric in ("seconds", "peak_rss_mb"):
+                if measured[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{scale}/{stage}: {metric} {measured[metric]:.3f} > "
+                        f"{reference[metric]:.3f} (+{tolerance:.0%})"
+                    )
+    return regressions
+
+
+def run_benchmarks(
+    scales: Optional[list] = ("small",),
+    workdir: Optional[str] = "ismn_benchmark",
+    n_cores: Optional[int] = 8,
+    baseline: Optional[str] = None,
+    tolerance: Optional[float] = 0.2,
+    save_as: Optional[str] = None,
+) -> dict:
+    """Generates (once) a synthetic database per scale, runs the pipeline stages on \
+        it and compares the results with a stored baseline.
+    :param scales: The names of the scales, see SCALES, by default ["small"]
+    :type scales: Optional[list]
+    :param workdir: The directory holding the synthetic databases, \
+        by default "ismn_benchmark"
+    :type workdir: Optional[str]
+    :param n_cores: The number of workers of the stages, by default 8
+    :type n_cores: Optional[int]
+    :param baseline: A JSON file of earlier results to compare with
+    :type baseline: Optional[str]
+    :param tolerance: The accepted relative increase over the baseline, \
+        by default 0.2
+    :type tolerance: Optional[float]
+    :param save_as: A JSON file the results are written to, e.g. as new baseline
+    :type save_as: Optional[str]
+    :raises RuntimeError: If a stage regressed beyond the tolerance
+    :return: Seconds, throughput and peak memory per scale and stage
+    :rtype: dict
+    """
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    results = {}
+    try:
+        # myismn resolves databases relative to the working directory
+        os.chdir(workdir)
+        for scale in scales:
+            database = f"SYNTHETIC_{scale}"
+            if not os.path.isdir(database):
+                print(f"Generating the {scale} synthetic database")
+                make_synthetic_archive(database, **SCALES[scale])
+            results[scale] = run_stages(database, n_cores)
+    finally:
+        os.chdir(cwd)
+
+    for scale, stages in results.items():
+        for stage, measured in stages.items():
+            print(
+                f"{scale:>8} {stage:<18} {measured['seconds']:9.3f} s "
+                f"{measured['files_per_second']:9.1f} files/s "
+                f"{measured['mb_per_second']:8.2f} MB/s "
+                f"{measured['peak_rss_mb']:8.1f} MB"
+            )
+
+    if save_as is not None:
+        with open(save_as, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if baseline is not None:
+        with open(baseline) as json_file:
+            regressions = compare_to_baseline(results, json.load(json_file), tolerance)
+        if regressions:
+            raise RuntimeError("Performance regressions:\n" + "\n".join(regressions))
+        print("No regressions compared to the baseline")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the MyISMN pipeline on synthetic ISMN databases."
+    )
+    parser.add_argument("--scales", nargs="+", default=["small"], choices=SCALES)
+    parser.add_argument("--workdir", default="ismn_benchmark")
+    parser.add_argument("--n-cores", type=int, default=8)
+    parser.add_argument("--baseline", help="JSON file of earlier results")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-as", help="JSON file the results are written to")
+    args = parser.parse_args()
+
+    run_benchmarks(
+        args.scales,
+        args.workdir,
+        args.n_cores,
+        args.baseline,
+        args.tolerance,
+        args.save_as,
+    )
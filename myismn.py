@@ -1,21 +1,419 @@
-from typing import Any, Optional, TypeVar
+from __future__ import annotations
+
+from typing import Any, Iterator, Optional, TypeVar
+import bisect
+import csv
+import gc
+import importlib
 import os
+import pickle
+import queue
+import shutil
+import subprocess
 import sys
+import threading
+import zipfile
+import zlib
+import json
+from collections import defaultdict
+from collections.abc import Mapping
+from contextlib import nullcontext
+import datetime
+import hashlib
+import io
+from functools import lru_cache, partial, wraps
+import time
+from glob import iglob
+from operator import ge, gt, le, lt
+from statistics import NormalDist
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first attribute access. The \
+        module then replaces the stand-in among the globals of myismn, so that later \
+        accesses cost nothing."""
+
+    def __init__(self, alias: str, name: str) -> None:
+        self._alias = alias
+        self._name = name
+
+    def __getattr__(self, attribute: str) -> Any:
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+
+# heavy dependencies, loaded on first use so that importing myismn stays fast
+ismn_interface = LazyModule("ismn_interface", "ismn.interface")
+natsort = LazyModule("natsort", "natsort")
+tqdm = LazyModule("tqdm", "tqdm")
+pl = LazyModule("pl", "polars")
+multiprocessing = LazyModule("multiprocessing", "multiprocessing")
+multiprocessing_pool = LazyModule("multiprocessing_pool", "multiprocessing.pool")
+np = LazyModule("np", "numpy")
+pd = LazyModule("pd", "pandas")
+scipy_spatial = LazyModule("scipy_spatial", "scipy.spatial")
+
+
+def check_import_time(budget_ms: Optional[float] = 100.0) -> float:
+    """Measures how long importing myismn takes in a fresh interpreter, e.g. to \
+        keep the startup of short jobs and worker processes fast.
+    :param budget_ms: The maximum import time in milliseconds, by default 100
+    :type budget_ms: Optional[float]
+    :raises RuntimeError: If the import takes longer than the budget
+    :return: The import time in milliseconds
+    :rtype: float
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    elapsed_ms = float(
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, time; "
+                f"sys.path.insert(0, {module_dir!r}); "
+                "start = time.perf_counter(); "
+                "import myismn; "
+                "print((time.perf_counter() - start) * 1000)",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    )
+    if elapsed_ms > budget_ms:
+        raise RuntimeError(
+            f"Importing myismn took {elapsed_ms:.1f} ms, the budget is {budget_ms} ms."
+        )
+
+    return elapsed_ms
+
+
+class SoilMoistureFlag:
+    """Interned soil moisture flag contained in the ISMN database. There is exactly \
+        one instance per flag code, each owning one bit of the flag bitmasks."""
+
+    __slots__ = ("kind", "bit", "mask", "category", "meaning")
+    _registry: dict = {}
+
+    def __new__(cls, kind: str) -> "SoilMoistureFlag":
+        try:
+            return cls._registry[kind]
+        except KeyError:
+            raise AttributeError(
+                f"There is no soil moisture flag '{kind}' contained in the ISMN database"
+            ) from None
+
+    @classmethod
+    def register(cls, kind: str, category: str, meaning: str) -> "SoilMoistureFlag":
+        flag = object.__new__(cls)
+        flag.kind = kind
+        flag.bit = len(cls._registry)
+        flag.mask = 1 << flag.bit
+        flag.category = category
+        flag.meaning = meaning
+        cls._registry[kind] = flag
+
+        return flag
+
+    @classmethod
+    def codes(cls) -> list:
+        return list(cls._registry)
+
+    def __reduce__(self):
+        return (SoilMoistureFlag, (self.kind,))
+
+    def __str__(self):
+        return f'Soil Moisture Flag "{self.kind}" means "{self.meaning}"'
+
+    def __repr__(self):
+        return f"SoilMoistureFlag('{self.kind}')"
+
+
+for _kind, _category, _meaning in [
+    (
+        "C01",
+        "reported value exceeds output format field size",
+        "soil moisture < 0.0 m^3/m^3",
+    ),
+    (
+        "C02",
+        "reported value exceeds output format field size",
+        "soil moisture > 0.6 m^3/m^3",
+    ),
+    (
+        "C03",
+        "reported value exceeds output format field size",
+        "soil moisture > saturation point (derived from HWSD parameter values)",
+    ),
+    (
+        "D01",
+        "questionable/dubious - geophysical based",
+        "in situ soil temperature (at corresponding depth layer) < 0°C",
+    ),
+    (
+        "D02",
+        "questionable/dubious - geophysical based",
+        "in situ air temperature < 0°C",
+    ),
+    (
+        "D03",
+        "questionable/dubious - geophysical based",
+        "GLDAS soil temperature (at corresponding depth layer) < 0°C",
+    ),
+    (
+        "D04",
+        "questionable/dubious - geophysical based",
+        "soil moisture shows peaks without precipitation event (in situ) in the preceding 24 hours",
+    ),
+    (
+        "D05",
+        "questionable/dubious - geophysical based",
+        "soil moisture shows peaks without precipitation event (GLDAS) in the preceding 24 hours",
+    ),
+    (
+        "D06",
+        "questionable/dubious - spectrum based",
+        "a spike is detected in soil moisture spectrum",
+    ),
+    (
+        "D07",
+        "questionable/dubious - spectrum based",
+        "a negative jump is detected in soil moisture spectrum",
+    ),
+    (
+        "D08",
+        "questionable/dubious - spectrum based",
+        "a positive jump is detected in soil moisture spectrum",
+    ),
+    (
+        "D09",
+        "questionable/dubious - spectrum based",
+        "low constant values (for a minimum time of 12 hours) occur in soil moisture spectrum",
+    ),
+    (
+        "D10",
+        "questionable/dubious - spectrum based",
+        "saturated plateau (for a minimum time length of 12 hours) occurs in soil moisture spectrum",
+    ),
+    ("G", "dynamic variable", "Good"),
+    ("M", "dynamic variable", "Parameter value missing"),
+]:
+    SoilMoistureFlag.register(_kind, _category, _meaning)
+
+IGNORED_FLAG_TOKENS = frozenset(["OK"])
+
+FLAG_CATEGORIES = {
+    "C": "reported value exceeds output format field size",
+    "D-geophysical": "questionable/dubious - geophysical based",
+    "D-spectrum": "questionable/dubious - spectrum based",
+    "dynamic": "dynamic variable",
+}
+
+# abbreviations used in the .stm filenames
+ISMN_VARIABLES = {
+    "sm": "soil_moisture",
+    "ts": "soil_temperature",
+    "ta": "air_temperature",
+    "p": "precipitation",
+    "sd": "snow_depth",
+    "sweq": "snow_water_equivalent",
+    "su": "soil_suction",
+    "tsf": "surface_temperature",
+}
+
+# the geophysical and spectrum based checks, as well as the saturation check C03,
+# only exist for soil moisture; the other variables get the range checks only
+FLAG_VOCABULARIES = {
+    "sm": [kind for kind in SoilMoistureFlag.codes() if kind != "M"],
+    **{
+        variable: ["C01", "C02", "G"] for variable in ISMN_VARIABLES if variable != "sm"
+    },
+}
+
+
+def flag_vocabulary(variable: str) -> list:
+    """Returns the flags the ISMN quality control assigns to a variable.
+    :param variable: The variable abbreviation of the .stm filename, e.g. "ts"
+    :type variable: str
+    :return: The flag codes, all except "M" for unknown variables
+    :rtype: list
+    """
+    return FLAG_VOCABULARIES.get(variable, FLAG_VOCABULARIES["sm"])
+
+
+@lru_cache(maxsize=None)
+def parse_flag_string(flag_string: str) -> tuple[int, tuple]:
+    """Parses a raw .stm flag string, which may combine several flags separated by \
+        commas or spaces (e.g. "D01,D02"), into a bitmask.
+    :param flag_string: The flag string as found in the .stm file
+    :type flag_string: str
+    :return: The bitmask of all known flags and the parts that are no known flag
+    :rtype: tuple[int, tuple]
+    """
+    mask = 0
+    faulty = []
+    for part in flag_string.replace(",", " ").split():
+        if part in SoilMoistureFlag._registry:
+            mask |= SoilMoistureFlag._registry[part].mask
+        elif part not in IGNORED_FLAG_TOKENS:
+            faulty.append(part)
+
+    return mask, tuple(faulty)
+
+
+def count_flag_strings(flag_strings: pl.Series) -> np.ndarray:
+    """Counts how often each flag occurs in a column of raw flag strings. \
+        Every distinct string is parsed only once.
+    :param flag_strings: The flag column of a sensor
+    :type flag_strings: pl.Series
+    :return: The number of occurrences of every flag, in the order of the registry
+    :rtype: np.ndarray
+    """
+    counts = np.zeros(len(SoilMoistureFlag._registry), dtype=np.int64)
+    value_counts = flag_strings.drop_nulls().value_counts()
+    for flag_string, count in zip(
+        value_counts.to_series(0).to_list(), value_counts.to_series(1).to_list()
+    ):
+        mask = parse_flag_string(flag_string)[0]
+        while mask:
+            bit = (mask & -mask).bit_length() - 1
+            counts[bit] += count
+            mask &= mask - 1
+
+    return counts
+
+
+_zip_archives = threading.local()
+
+
+def open_archive(archive: str) -> zipfile.ZipFile:
+    """Opens a zip archive once per thread. The central directory is parsed on \
+        opening, so members are afterwards read by seeking straight to their offsets, \
+        and every thread reads through its own file handle.
+    :param archive: Path to the zip archive
+    :type archive: str
+    :return: The opened archive
+    :rtype: zipfile.ZipFile
+    """
+    archives = _zip_archives.__dict__
+    if archive not in archives:
+        archives[archive] = zipfile.ZipFile(archive)
+
+    return archives[archive]
+
+
+def split_archive_path(sensor_path: str) -> tuple[Optional[str], str]:
+    """Splits a path of the form "<archive>.zip/<member>" into the archive and the \
+        member name. Paths outside of an archive are returned unchanged.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :return: The path to the archive (None for plain files) and the member name
+    :rtype: tuple[Optional[str], str]
+    """
+    archive, separator, member = sensor_path.partition(".zip" + os.sep)
+    if not separator:
+        return None, sensor_path
+
+    return archive + ".zip", member.replace(os.sep, "/")
+
+
+def read_sensor_file(sensor_path: str) -> bytes:
+    archive, member = split_archive_path(sensor_path)
+    if archive is None:
+        with open(sensor_path, "rb") as sensor_file:
+            return sensor_file.read()
+
+    return open_archive(archive).read(member)
+
+
+def sensor_source(sensor_path: str) -> Any:
+    """Returns what the readers should parse: the path of a plain file, which polars \
+        can map into memory, or the content of an archive member.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :return: The path or the content of the file
+    :rtype: Any
+    """
+    if split_archive_path(sensor_path)[0] is None:
+        return sensor_path
+
+    return read_sensor_file(sensor_path)
+
+
+def sensor_file_size(sensor_path: str) -> int:
+    archive, member = split_archive_path(sensor_path)
+    if archive is None:
+        return os.path.getsize(sensor_path)
+
+    return open_archive(archive).getinfo(member).file_size
+
+
+def sensor_fingerprint(
+    sensor_path: str, n_bytes: Optional[int] = 4096, use_crc: Optional[bool] = True
+) -> tuple[int, str, str]:
+    """Fingerprints a .stm file by its size and a hash of its first and last bytes.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :param n_bytes: The number of bytes hashed at the head and the tail, by default 4096
+    :type n_bytes: Optional[int]
+    :param use_crc: If True, members of a zip archive are fingerprinted by the size \
+        and CRC stored in the central directory instead of the hash of their tail, \
+        so that only their first block is decompressed, by default True
+    :type use_crc: Optional[bool]
+    :return: The size, the hash of the head and the hash of the tail (or the CRC)
+    :rtype: tuple[int, str, str]
+    """
+    archive, member = split_archive_path(sensor_path)
+    if archive is not None and use_crc:
+        zip_file = open_archive(archive)
+        info = zip_file.getinfo(member)
+        # the head hash tells an extended record from a rewritten one
+        with zip_file.open(member) as member_file:
+            head = member_file.read(n_bytes)
+        return (
+            info.file_size,
+            hashlib.blake2b(head, digest_size=8).hexdigest(),
+            f"{info.CRC:08x}",
+        )
+
+    if archive is not None:
+        data = read_sensor_file(sensor_path)
+        size, head, tail = len(data), data[:n_bytes], data[-n_bytes:]
+
+    else:
+        size = os.path.getsize(sensor_path)
+        with open(sensor_path, "rb") as sensor_file:
+            head = sensor_file.read(n_bytes)
+            sensor_file.seek(max(0, size - n_bytes))
+            tail = sensor_file.read(n_bytes)
+
+    return (
+        size,
+        hashlib.blake2b(head, digest_size=8).hexdigest(),
+        hashlib.blake2b(tail, digest_size=8).hexdigest(),
+    )
+
 
-sys.path.append("/home/nbader/Documents/ISMN_data_opener_trial/")
-from ismn.interface import ISMN_Interface  # noqa: E402
-import json  # noqa: E402
-from collections import defaultdict  # noqa: E402
-from natsort import natsorted  # noqa: E402
-from tqdm import trange  # noqa: E402
-import datetime  # noqa: E402
-from functools import wraps  # noqa: E402
-import time  # noqa: E402
-import polars as pl  # noqa: E402
-from multiprocessing import Pool  # noqa: E402
-from glob import iglob  # noqa: E402
-import numpy as np  # noqa: E402
-import pandas as pd  # noqa: E402
+def header_reader(sensor_path: str) -> tuple:
+    """Reads only the first line of a .stm file, which holds the coordinates, \
+        elevation and depths of the sensor.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :return: The sensor path, latitude, longitude, elevation, depth from and depth to
+    :rtype: tuple
+    """
+    archive, member = split_archive_path(sensor_path)
+    if archive is None:
+        with open(sensor_path, "rb") as sensor_file:
+            header = sensor_file.readline()
+    else:
+        with open_archive(archive).open(member) as sensor_file:
+            header = sensor_file.readline()
+
+    # same layout as read by the ISMN module: CSE network station lat lon elev from to
+    fields = header.decode("latin-1").split()
+    return (sensor_path, *(float(field) for field in fields[3:8]))
 
 
 def flag_reader(sensor_path):
@@ -30,17 +428,766 @@ def flag_reader(sensor_path):
     )
 
 
+def flag_counter(sensor_path, data: Optional[bytes] = None) -> tuple[str, np.ndarray]:
+    """Reads the flags of one sensor and counts them in the worker, so that only \
+        a small count vector (in the order of the registry) is sent back.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :param data: The content of the .stm file, if already read (see prefetch_files)
+    :type data: Optional[bytes]
+    :return: The sensor path and the number of occurrences of every flag
+    :rtype: tuple[str, np.ndarray]
+    """
+    flags = flag_reader(data if data is not None else sensor_source(sensor_path))
+    return sensor_path, count_flag_strings(flags.to_series(0))
+
+
+def flag_block_sampler(
+    sensor_path: str, n_blocks: int, block_bytes: int, seed: int
+) -> tuple[str, np.ndarray, np.ndarray, float, bool]:
+    """Counts the flags in a few blocks of rows at random byte offsets of a .stm \
+        file, seeking to them instead of reading the whole file. Files smaller than \
+        all blocks together are read completely, as one block.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :param n_blocks: The number of blocks
+    :type n_blocks: int
+    :param block_bytes: The size of a block in bytes
+    :type block_bytes: int
+    :param seed: The seed of the random offsets
+    :type seed: int
+    :return: The sensor path, the flag counts of each block (in the order of the \
+        registry), the number of rows of each block, the estimated number of rows \
+        of the file and whether the file was read completely
+    :rtype: tuple[str, np.ndarray, np.ndarray, float, bool]
+    """
+    archive, member = split_archive_path(sensor_path)
+    size = sensor_file_size(sensor_path)
+    sensor_file = (
+        open(sensor_path, "rb")
+        if archive is None
+        else open_archive(archive).open(member)
+    )
+    with sensor_file:
+        first_row = len(sensor_file.readline())
+        complete = size - first_row <= n_blocks * block_bytes
+        if complete:
+            # the first and the last line of a block are skipped as partial lines
+            blocks = [b"\n" + sensor_file.read() + b"\n"]
+        else:
+            rng = np.random.default_rng([seed, zlib.crc32(sensor_path.encode())])
+            offsets = rng.integers(first_row, size - block_bytes, n_blocks)
+            blocks = []
+            for offset in np.sort(offsets):
+                sensor_file.seek(offset)
+                blocks.append(sensor_file.read(block_bytes))
+
+    bits = np.array([SoilMoistureFlag(flag).bit for flag in SoilMoistureFlag.codes()])
+    counts = np.zeros((len(blocks), len(bits)), dtype=np.int64)
+    rows = np.zeros(len(blocks), dtype=np.int64)
+    for i, block in enumerate(blocks):
+        lines = block.split(b"\n")[1:-1]
+        masks = np.array(
+            [
+                parse_flag_string(fields[3].decode())[0]
+                for fields in map(bytes.split, lines)
+                if len(fields) > 3
+            ],
+            dtype=np.int64,
+        )
+        counts[i] = ((masks[:, None] >> bits) & 1).sum(axis=0)
+        rows[i] = len(masks)
+
+    if complete:
+        return sensor_path, counts, rows, float(rows.sum()), True
+
+    sampled_bytes = sum(len(block) for block in blocks)
+    estimated_rows = (size - first_row) * rows.sum() / max(sampled_bytes, 1)
+    return sensor_path, counts, rows, estimated_rows, False
+
+
+def prefetch_files(
+    sensor_batches: list,
+    n_io_threads: Optional[int] = 4,
+    queue_depth: Optional[int] = 16,
+    budget: Optional["MemoryBudget"] = None,
+) -> Iterator[tuple]:
+    """Reads batches of files ahead in background threads, one batch per thread, \
+        and yields each batch as soon as all its files are read, so that storage \
+        latency overlaps with parsing. At most "queue_depth" batches are held in \
+        memory waiting to be consumed.
+    :param sensor_batches: Tuples of paths to the files, read roughly in this order
+    :type sensor_batches: list
+    :param n_io_threads: The number of threads reading files, by default 4
+    :type n_io_threads: Optional[int]
+    :param queue_depth: The maximum number of read but not yet consumed batches, \
+        by default 16
+    :type queue_depth: Optional[int]
+    :param budget: If given, the size of every batch (see sensor_file_size) is \
+        acquired from it before its files are read. The consumer takes over the \
+        charge and releases it once it is done with the batch
+    :type budget: Optional[MemoryBudget]
+    :return: The path and the raw bytes of every file of a batch, the batches \
+        in the order they were read
+    :rtype: Iterator[tuple]
+    """
+    buffer = queue.Queue(maxsize=queue_depth)
+    batches = iter(sensor_batches)
+    lock = threading.Lock()
+    stop = threading.Event()
+    done = object()
+
+    def put(item: Any) -> None:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read_ahead() -> None:
+        try:
+            while not stop.is_set():
+                with lock:
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                if budget is not None and not budget.acquire(
+                    sum(map(sensor_file_size, batch))
+                ):
+                    break
+                put(tuple((path, read_sensor_file(path)) for path in batch))
+        except (OSError, zipfile.BadZipFile) as error:
+            put(error)
+        finally:
+            put(done)
+
+    threads = [
+        threading.Thread(target=read_ahead, daemon=True) for _ in range(n_io_threads)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < n_io_threads:
+            item = buffer.get()
+            if item is done:
+                finished += 1
+            elif isinstance(item, (OSError, zipfile.BadZipFile)):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def sensor_flag_dict(sensor_item: tuple, flags: tuple) -> tuple:
+    """Counts the flags of a sensor loaded by the ISMN module.
+    :param sensor_item: The network name, station name and ISMN sensor
+    :type sensor_item: tuple
+    :param flags: The flags to be counted
+    :type flags: tuple
+    :return: The network, station and sensor names, the flag counts sorted by \
+        frequency and the (flag string, faulty part) of every unknown flag
+    :rtype: tuple
+    """
+    network_name, station_name, sensor = sensor_item
+    sensor_flag_dict_entangled = (
+        sensor.data[f"{sensor.variable}_flag"].value_counts(ascending=False).to_dict()
+    )
+    sensor_flag_dict_disentangled = defaultdict(int)
+    faulty_parts = []
+
+    for key, item in sensor_flag_dict_entangled.items():
+        mask, faulty = parse_flag_string(key)
+        for flag in flags:
+            if mask & SoilMoistureFlag(flag).mask:
+                sensor_flag_dict_disentangled[flag] += int(item)
+
+        faulty_parts.extend((key, splitter) for splitter in faulty)
+
+    sensor_flag_dict_disentangled = dict(
+        sorted(
+            sensor_flag_dict_disentangled.items(),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+    )
+
+    return (
+        network_name,
+        station_name,
+        sensor.name,
+        sensor_flag_dict_disentangled,
+        faulty_parts,
+    )
+
+
+_country_checkers = threading.local()
+
+
+def country_from_coords(coords: tuple) -> str:
+    """Get the ISO code of the country containing the coordinates. The shapefile is \
+        loaded once per thread, as OGR objects must not be shared between threads.
+    :param coords: The latitude and longitude of the location
+    :type coords: tuple
+    :return: The ISO code of the country, "None" if no country contains the location
+    :rtype: str
+    """
+    if not hasattr(_country_checkers, "checker"):
+        # CoordPy ships with this package, but myismn may also run as a script
+        try:
+            from .CoordPy import countries
+        except ImportError:
+            from CoordPy import countries
+
+        _country_checkers.checker = countries.CountryChecker(
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "CoordPy",
+                "TM_WORLD_BORDERS",
+                "TM_WORLD_BORDERS-0.3.shp",
+            )
+        )
+        _country_checkers.point = countries.Point
+
+    try:
+        return _country_checkers.checker.getCountry(
+            _country_checkers.point(*coords)
+        ).iso
+
+    except AttributeError:
+        return "None"
+
+
+def flag_batch_counter(batch: tuple) -> tuple[int, float, list]:
+    """Counts the flags of a batch of sensors and measures how long the worker \
+        was busy doing so.
+    :param batch: Paths to the .stm files of the sensors, or (path, content) \
+        tuples of files read by prefetch_files
+    :type batch: tuple
+    :return: The worker ID (thread ID, which equals the process ID for the main \
+        thread of a worker process), the busy time in seconds and the \
+        (path, counts) of every sensor in the batch
+    :rtype: tuple[int, float, list]
+    """
+    start_time = time.perf_counter()
+    results = [
+        flag_counter(*item) if isinstance(item, tuple) else flag_counter(item)
+        for item in batch
+    ]
+
+    return threading.get_native_id(), time.perf_counter() - start_time, results
+
+
+def schedule_tasks(sensor_paths: list, sizes: dict, n_workers: int) -> list[tuple]:
+    """Orders the sensors largest file first and packs them into batches whose size \
+        shrinks with the remaining work (guided scheduling): the largest files are \
+        issued alone at the start, the small ones in ever smaller batches at the end, \
+        so that all workers finish at about the same time.
+    :param sensor_paths: Paths to the .stm files of the sensors
+    :type sensor_paths: list
+    :param sizes: The file size in bytes of every sensor path
+    :type sizes: dict
+    :param n_workers: The number of workers
+    :type n_workers: int
+    :return: The batches of sensor paths, in the order they should be issued
+    :rtype: list[tuple]
+    """
+    remaining_bytes = sum(sizes[sensor_path] for sensor_path in sensor_paths)
+    batches, batch, batch_bytes = [], [], 0
+    for sensor_path in sorted(sensor_paths, key=sizes.__getitem__, reverse=True):
+        batch.append(sensor_path)
+        batch_bytes += sizes[sensor_path]
+        if batch_bytes >= remaining_bytes / (2 * n_workers):
+            batches.append(tuple(batch))
+            remaining_bytes -= batch_bytes
+            batch, batch_bytes = [], 0
+
+    if batch:
+        batches.append(tuple(batch))
+
+    return batches
+
+
+class MemoryBudget:
+    """Bounds the number of bytes handed out to workers but not yet returned. \
+        A single task larger than the budget is still admitted when nothing else \
+        is in flight."""
+
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, n_bytes: int) -> bool:
+        with self._condition:
+            while (
+                not self.closed
+                and self.max_bytes is not None
+                and self.in_flight > 0
+                and self.in_flight + n_bytes > self.max_bytes
+            ):
+                self._condition.wait()
+
+            if self.closed:
+                return False
+
+            self.in_flight += n_bytes
+            return True
+
+    def release(self, n_bytes: int) -> None:
+        with self._condition:
+            self.in_flight -= n_bytes
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class Executor:
+    """Runs tasks serially, in a thread pool or in a process pool behind the \
+        interface of multiprocessing.Pool. Threads share memory with the caller, so \
+        results are never pickled; processes also parallelize pure Python work."""
+
+    backends = ["serial", "threads", "processes"]
+
+    def __init__(
+        self,
+        backend: Optional[str] = "auto",
+        n_workers: Optional[int] = 8,
+        n_tasks: Optional[int] = None,
+        releases_gil: Optional[bool] = True,
+    ) -> None:
+        """
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor.choose_backend
+        :type backend: Optional[str]
+        :param n_workers: The number of threads or processes, by default 8
+        :type n_workers: Optional[int]
+        :param n_tasks: The number of tasks, if known, used by the "auto" backend
+        :type n_tasks: Optional[int]
+        :param releases_gil: Whether the tasks spend most of their time outside of \
+            the GIL (e.g. parsing with polars), used by the "auto" backend
+        :type releases_gil: Optional[bool]
+        """
+        if backend == "auto":
+            backend = self.choose_backend(n_workers, n_tasks, releases_gil)
+        if backend not in self.backends:
+            raise ValueError(
+                f'The backend "{backend}" is none of {self.backends} or "auto".'
+            )
+
+        self.backend = backend
+        self.n_workers = n_workers
+        self._pool = None
+
+    @staticmethod
+    def choose_backend(
+        n_workers: int, n_tasks: Optional[int], releases_gil: bool
+    ) -> str:
+        """Picks serial execution for a handful of tasks, threads for tasks that \
+            release the GIL and processes otherwise."""
+        if n_workers <= 1 or (n_tasks is not None and n_tasks < 2 * n_workers):
+            return "serial"
+
+        return "threads" if releases_gil else "processes"
+
+    def __enter__(self) -> "Executor":
+        if self.backend == "threads":
+            self._pool = multiprocessing_pool.ThreadPool(self.n_workers)
+        elif self.backend == "processes":
+            # forking after polars started its thread pool can deadlock the workers
+            self._pool = multiprocessing.get_context("spawn").Pool(self.n_workers)
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def map(self, func, iterable, chunksize: Optional[int] = None) -> list:
+        if self._pool is None:
+            return [func(item) for item in iterable]
+
+        return self._pool.map(func, iterable, chunksize=chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize: Optional[int] = 1) -> Iterator:
+        if self._pool is None:
+            return (func(item) for item in iterable)
+
+        return self._pool.imap_unordered(func, iterable, chunksize=chunksize)
+
+
+def timeline_reader(sensor_path):
+    return pl.read_csv(
+        source=sensor_path,
+        has_header=True,
+        columns=[0, 1, 3],
+        separator=" ",
+        dtypes=[pl.Utf8, pl.Utf8, pl.Utf8],
+        use_pyarrow=True,
+    )
+
+
+def series_reader(sensor_path):
+    return pl.read_csv(
+        source=sensor_path,
+        has_header=True,
+        columns=[0, 1, 2],
+        separator=" ",
+        dtypes=[pl.Utf8, pl.Utf8, pl.Float64],
+        use_pyarrow=True,
+    )
+
+
+def epoch_minutes(df: pl.DataFrame) -> np.ndarray:
+    """Converts the date and time columns of a .stm file into minutes since the epoch.
+    :param df: The .stm columns, date and time being the first two
+    :type df: pl.DataFrame
+    :return: The timestamp of each row in minutes since the epoch
+    :rtype: np.ndarray
+    """
+    return (df.to_series(0) + " " + df.to_series(1)).str.strptime(
+        pl.Datetime, "%Y/%m/%d %H:%M"
+    ).dt.epoch("s").to_numpy() // 60
+
+
+def encode_flag_runs(
+    minutes: np.ndarray, masks: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compresses a time series of flag bitmasks into run-length segments. \
+        A new segment starts whenever the bitmask changes or the series has a gap \
+        larger than its typical sampling interval.
+    :param minutes: Timestamps of the observations in minutes since the epoch
+    :type minutes: np.ndarray
+    :param masks: Flag bitmask of each observation
+    :type masks: np.ndarray
+    :return: Start, (exclusive) end and bitmask of every segment
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    if len(minutes) == 0:
+        return (
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.uint32),
+        )
+
+    gaps = np.diff(minutes)
+    step = int(np.median(gaps)) if len(gaps) else 60
+    breaks = (masks[1:] != masks[:-1]) | (gaps > step)
+    first = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+    last = np.concatenate((first[1:] - 1, [len(minutes) - 1]))
+
+    return (
+        minutes[first].astype(np.int32),
+        (minutes[last] + step).astype(np.int32),
+        masks[first].astype(np.uint32),
+    )
+
+
+def timeline_encoder(sensor_path) -> tuple:
+    """Reads the timestamps and flags of one sensor and returns its run-length \
+        encoded quality timeline. Compound flags (e.g. "D01,D02") set several bits.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :return: The sensor path and the starts, ends and bitmasks of its segments
+    :rtype: tuple
+    """
+    df = timeline_reader(sensor_source(sensor_path))
+    minutes = epoch_minutes(df)
+
+    return (sensor_path, *encode_flag_runs(minutes, flag_masks(df.to_series(2))))
+
+
+def flag_masks(flag_strings: pl.Series) -> np.ndarray:
+    """Converts a column of raw flag strings into bitmasks. Every distinct string \
+        is parsed only once.
+    :param flag_strings: The flag column of a sensor
+    :type flag_strings: pl.Series
+    :return: The bitmask of each observation, 0 for missing flags
+    :rtype: np.ndarray
+    """
+    codes, uniques = pd.factorize(flag_strings.to_numpy())
+    lookup = np.array(
+        [parse_flag_string(flag)[0] for flag in uniques]
+        + [0],  # missing flags are factorized to -1
+        dtype=np.uint32,
+    )
+
+    return lookup[codes]
+
+
+def matrix_reader(sensor_path):
+    return pl.read_csv(
+        source=sensor_path,
+        has_header=True,
+        columns=[0, 1, 2, 3],
+        separator=" ",
+        dtypes=[pl.Utf8, pl.Utf8, pl.Float64, pl.Utf8],
+        use_pyarrow=True,
+    )
+
+
+def matrix_row_writer(task: tuple) -> tuple[int, int]:
+    """Resamples a chunk of sensors to the time axis of a sensor matrix and writes \
+        their rows straight into the memory-mapped matrices. The value of a time \
+        step is the mean of the valid observations within it, its flags are the \
+        union of the flags of all observations within it.
+    :param task: The store, the row of the first sensor, the sensor paths, the \
+        first time step and the step length in minutes since the epoch, and the \
+        number of time steps
+    :type task: tuple
+    :return: The row of the first sensor and the number of valid observations \
+        written
+    :rtype: tuple[int, int]
+    """
+    store, first_row, sensor_paths, start, step, n_steps = task
+    values = np.load(os.path.join(store, "values.npy"), mmap_mode="r+")
+    flags = np.load(os.path.join(store, "flags.npy"), mmap_mode="r+")
+
+    n_observations = 0
+    for row, sensor_path in enumerate(sensor_paths, first_row):
+        df = matrix_reader(sensor_source(sensor_path))
+        columns = (epoch_minutes(df) - start) // step
+        inside = (columns >= 0) & (columns < n_steps)
+        columns = columns[inside]
+        observations = df.to_series(2).to_numpy()[inside]
+        valid = np.isfinite(observations)
+
+        sums = np.bincount(
+            columns[valid], weights=observations[valid], minlength=n_steps
+        )
+        counts = np.bincount(columns[valid], minlength=n_steps)
+        with np.errstate(invalid="ignore"):
+            values[row] = sums / counts  # empty time steps become NaN
+
+        row_flags = np.zeros(n_steps, dtype=np.uint32)
+        np.bitwise_or.at(row_flags, columns, flag_masks(df.to_series(3))[inside])
+        flags[row] = row_flags
+        n_observations += int(valid.sum())
+
+    values.flush()
+    flags.flush()
+
+    return first_row, n_observations
+
+
+class Span:
+    """A timed section of the code, see Metrics.span."""
+
+    __slots__ = ("metrics", "name", "path", "parent", "counters", "start")
+
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> "Span":
+        stack = self.metrics._stack()
+        self.parent = stack[-1].path if stack else None
+        self.path = f"{self.parent}/{self.name}" if stack else self.name
+        self.counters = defaultdict(float)
+        stack.append(self)
+        self.metrics.sample_rss()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        end = time.perf_counter()
+        self.metrics._stack().pop()
+        self.metrics.spans.append(
+            {
+                "name": self.name,
+                "path": self.path,
+                "parent": self.parent,
+                "thread": threading.current_thread().name,
+                "start": self.start - self.metrics.t0,
+                "duration": end - self.start,
+                "peak_rss_mb": self.metrics.peak_rss(self.start) / 1024**2,
+                **self.counters,
+            }
+        )
+
+
+class Metrics:
+    """Registry of nested timing spans, counters and resident memory samples. \
+        Disabled by default, in which case spans and counters cost a single \
+        attribute check."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._sampler_stop = threading.Event()
+        self.reset()
+
+    def reset(self) -> None:
+        """Discards all recorded spans, counters and memory samples."""
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.counters = defaultdict(float)
+        with self._lock:
+            self._rss_times, self._rss_values = [], []
+
+    def enable(self, rss_interval: Optional[float] = 0.1) -> None:
+        """Starts recording. Enabling again replaces the background sampler.
+        :param rss_interval: Seconds between two samples of the resident memory \
+            taken in the background, by default 0.1. None samples only when \
+            spans begin and end
+        :type rss_interval: Optional[float]
+        """
+        self.enabled = True
+        self._stop_sampler()
+        if rss_interval is not None:
+
+            def sampler() -> None:
+                while not self._sampler_stop.wait(rss_interval):
+                    self.sample_rss()
+
+            self._sampler = threading.Thread(
+                target=sampler, name="rss-sampler", daemon=True
+            )
+            self._sampler.start()
+
+    def disable(self) -> None:
+        """Stops recording, the recorded data is kept."""
+        self.enabled = False
+        self._stop_sampler()
+
+    def _stop_sampler(self) -> None:
+        if self._sampler is not None:
+            self._sampler_stop.set()
+            self._sampler.join()
+            self._sampler = None
+        self._sampler_stop.clear()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name: str) -> Any:
+        """Times the enclosed block, nested in the span currently open in this thread.
+        :param name: The name of the span
+        :type name: str
+        :return: A context manager
+        :rtype: Any
+        """
+        return Span(self, name) if self.enabled else _no_span
+
+    def count(self, name: str, value: Optional[float] = 1) -> None:
+        """Adds to a counter, both in total and in the innermost open span.
+        :param name: The name of the counter, e.g. "files", "bytes", "rows", "flags"
+        :type name: str
+        :param value: The amount added, by default 1
+        :type value: Optional[float]
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+        stack = self._stack()
+        if stack:
+            stack[-1].counters[name] += value
+
+    def sample_rss(self) -> None:
+        """Records the current resident memory of the process."""
+        try:
+            with open("/proc/self/statm") as statm:
+                rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            import resource
+
+            # the lifetime peak, where the current value is not available
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        with self._lock:
+            self._rss_times.append(time.perf_counter())
+            self._rss_values.append(rss)
+
+    def peak_rss(self, since: Optional[float] = None) -> int:
+        """The highest resident memory sampled.
+        :param since: Only samples taken after this time.perf_counter() value
+        :type since: Optional[float]
+        :return: The peak in bytes
+        :rtype: int
+        """
+        self.sample_rss()
+        with self._lock:
+            first = (
+                bisect.bisect_left(self._rss_times, since) if since is not None else 0
+            )
+            return max(self._rss_values[first:])
+
+    def to_json(self, path: str) -> None:
+        """Writes the spans, the counter totals and the peak memory to a JSON file.
+        :param path: The path of the JSON file
+        :type path: str
+        """
+        with open(path, "w") as json_file:
+            json.dump(
+                {
+                    "spans": self.spans,
+                    "counters": dict(self.counters),
+                    "peak_rss_mb": self.peak_rss() / 1024**2,
+                },
+                json_file,
+                indent=2,
+            )
+
+    def to_csv(self, path: str) -> None:
+        """Writes one row per span, with one column per counter, to a CSV file.
+        :param path: The path of the CSV file
+        :type path: str
+        """
+        columns = list(dict.fromkeys(key for span in self.spans for key in span))
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.spans)
+
+    def export(self, directory: str) -> str:
+        """Writes the recorded run as "metrics_<time>.json" and "metrics_<time>.csv".
+        :param directory: The directory of the files
+        :type directory: str
+        :return: The common path of both files, without extension
+        :rtype: str
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"metrics_{datetime.datetime.now():%Y%m%d_%H%M%S}"
+        )
+        self.to_json(f"{path}.json")
+        self.to_csv(f"{path}.csv")
+        return path
+
+
+_no_span = nullcontext()
+metrics = Metrics()
+
+
+def count_sensor_files(sensor_paths: list) -> None:
+    """Adds the number and the total size of .stm files to the counters "files" \
+        and "bytes" of "metrics", if it is enabled.
+    :param sensor_paths: Paths to the .stm files
+    :type sensor_paths: list
+    """
+    if metrics.enabled:
+        metrics.count("files", len(sensor_paths))
+        metrics.count("bytes", sum(map(sensor_file_size, sensor_paths)))
+
+
 def timeit(func):
     @wraps(func)
     def timeit_wrapper(*args, **kwargs):
-        start_time = time.perf_counter()
-        result = func(*args, **kwargs)
-        end_time = time.perf_counter()
-        total_time = end_time - start_time
-        print(
-            f"\n\n\tFunction {func.__name__}{args} {kwargs} Took {total_time:.4f} seconds\n\n"
-        )
-        return result
+        # timings are recorded as spans of "metrics", see Metrics.enable
+        with metrics.span(func.__qualname__):
+            return func(*args, **kwargs)
 
     return timeit_wrapper
 
@@ -56,9 +1203,10 @@ class Tools:
 
     def __init__(self) -> None:
         self.root = os.getcwd()
+        self.archive = None
 
     def check_database(self, database_path: str) -> bool:
-        """Checks if the specified diectory containing the database exists.
+        """Checks if the specified diectory or zip archive containing the database exists.
         :param database_path: A string containing the path (absolute or relative) \
               to the database
         :type database_path: str
@@ -66,14 +1214,19 @@ class Tools:
         :rtype: bool
         """
 
-        if os.path.isdir(database_path):
+        if os.path.isdir(database_path) or zipfile.is_zipfile(database_path):
             return True
 
         else:
             return False
 
-    def get_database(self, database_path: str) -> tuple[ISMN_Interface, str]:
+    @timeit
+    def get_database(
+        self, database_path: str
+    ) -> tuple[ismn_interface.ISMN_Interface, str]:
         """Loads the ISMN database using the ISMN module from the specified path.
+        If the path is the zip archive downloaded from ISMN, it is read without \
+        extraction, and the json_dicts are stored in a directory named after it.
         :param database_path: A string containing the path (absolute or relative) to the database
         :type database_path: str
         :return: An ISMN database object and the name of the database
@@ -81,15 +1234,48 @@ class Tools:
         """  # noqa: E501
 
         __database_name: str = os.path.basename(os.path.normpath(database_path))
-        __database = ISMN_Interface(__database_name, parallel=True)
+        __database = ismn_interface.ISMN_Interface(__database_name, parallel=True)
+
+        if zipfile.is_zipfile(database_path):
+            self.archive = os.path.abspath(database_path)
+            __database_name = os.path.splitext(__database_name)[0]
 
         return __database, __database_name
 
+    def get_archive_sensors(self) -> list:
+        """Lists the .stm members of the zip archive, as "<archive>.zip/<member>" paths.
+        :return: The paths of all sensors in the archive
+        :rtype: list
+        """
+        return [
+            os.path.join(self.archive, *member.split("/"))
+            for member in open_archive(self.archive).namelist()
+            if member.endswith(".stm")
+        ]
+
+    def sensor_key(self, sensor_path: str) -> str:
+        """Returns the path of the sensor relative to the working directory as used \
+            in "sensor_df", the same for an extracted database and its zip archive.
+        :param sensor_path: Path to the .stm file of the sensor
+        :type sensor_path: str
+        :return: "<database name>/<network>/<station>/<file name>"
+        :rtype: str
+        """
+        return os.path.join(
+            self.database_name, *self.get_path_segments(sensor_path)[-3:]
+        )
+
     def __get_networks(self) -> tuple[list, list]:
+        if self.archive is not None:
+            __networks = natsort.natsorted(
+                {self.get_path_segments(f)[-3] for f in self.get_archive_sensors()}
+            )
+            return __networks, len(__networks)
+
         __root = os.getcwd()
         __path = os.path.join(__root, self.database_name)
         os.chdir(__path)
-        __networks = natsorted(
+        __networks = natsort.natsorted(
             [
                 x
                 for x in os.listdir(__path)
@@ -100,7 +1286,10 @@ class Tools:
         return __networks, len(__networks)
 
     def get_all_sensors(self) -> list:
-        return natsorted(
+        if self.archive is not None:
+            return natsort.natsorted(self.get_archive_sensors())
+
+        return natsort.natsorted(
             [
                 os.path.normpath(os.path.join(self.root, f))
                 for f in iglob(
@@ -110,6 +1299,114 @@ class Tools:
             ]
         )
 
+    @timeit
+    def read_headers(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> pd.DataFrame:
+        """Reads the coordinates, elevation and depths of every sensor from the first \
+            line of its .stm file, in parallel, without loading the ISMN metadata. \
+            The "path" column matches the one of "sensor_df".
+        :param n_cores: The number of workers, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: Network, station, latitude, longitude, elevation, depthfrom, \
+            depthto and path of every sensor
+        :rtype: pd.DataFrame
+        """
+        sensor_list = self.get_all_sensors()
+        with Executor(backend, n_cores, len(sensor_list)) as executor:
+            headers = executor.map(header_reader, sensor_list)
+        metrics.count("files", len(sensor_list))
+
+        columns = ["latitude", "longitude", "elevation", "depthfrom", "depthto"]
+        self.header_df = pd.DataFrame(
+            [values for _, *values in headers], columns=columns
+        )
+        self.header_df.insert(
+            0, "network", [self.get_path_segments(p)[-3] for p, *_ in headers]
+        )
+        self.header_df.insert(
+            1, "station", [self.get_path_segments(p)[-2] for p, *_ in headers]
+        )
+        self.header_df["path"] = [self.sensor_key(p) for p, *_ in headers]
+
+        return self.header_df
+
+    @timeit
+    def get_station_table(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> pd.DataFrame:
+        """Builds the table of all stations from the .stm headers and saves it as \
+            "station_df.pkl".
+        :param n_cores: The number of workers, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: Latitude, longitude, elevation, the sorted distinct (depthfrom, \
+            depthto) and the number of sensors per network and station
+        :rtype: pd.DataFrame
+        """
+        header_df = self.read_headers(n_cores, backend)
+        header_df["depths"] = list(zip(header_df["depthfrom"], header_df["depthto"]))
+        stations = header_df.groupby(["network", "station"], sort=False)
+        self.station_df = stations[["latitude", "longitude", "elevation"]].first()
+        self.station_df["depths"] = stations["depths"].agg(
+            lambda depths: sorted(set(depths))
+        )
+        self.station_df["n_sensors"] = stations.size()
+
+        self.station_df.to_pickle(
+            os.path.join(self.database_name, "json_dicts", "station_df.pkl")
+        )
+
+        return self.station_df
+
+    @timeit
+    def make_station_index(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> "StationIndex":
+        """Stores the coordinates of all stations together with the IDs of their \
+            sensors in "station_index.npz", from which a StationIndex is built.
+        :param n_cores: The number of workers used to read the .stm headers, \
+            by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The spatial index over all stations in the database
+        :rtype: StationIndex
+        """
+        index_file = os.path.join(
+            self.root, self.database_name, "json_dicts", "station_index.npz"
+        )
+        if self.file_exists(index_file):
+            print("station_index.npz exists")
+            return StationIndex(index_file)
+
+        sensor_df = self._get_sensor_df(n_cores, backend).sort_index()
+        stations = sensor_df.rename_axis("sensor_id").reset_index()
+        stations = stations.groupby(["network", "station"], sort=False)
+
+        coords = stations[["latitude", "longitude"]].first()
+        offsets = np.zeros(len(coords) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(stations.size().to_numpy())
+
+        np.savez(
+            index_file,
+            stations=np.array([f"{net}:{stat}" for net, stat in coords.index]),
+            latitudes=coords["latitude"].to_numpy(),
+            longitudes=coords["longitude"].to_numpy(),
+            offsets=offsets,
+            sensor_ids=np.concatenate(
+                [sensors["sensor_id"].to_numpy() for _, sensors in stations]
+            ).astype(str),
+        )
+
+        return StationIndex(index_file)
+
     def get_path_segments(self, path) -> list:
         segments = []
         pth, last = os.path.split(path)
@@ -120,69 +1417,89 @@ class Tools:
 
         return segments[::-1]
 
-    def make_sensor_ids(self) -> tuple[dict, dict, pd.DataFrame]:
-        _sensor_ids_arr = list(np.zeros(len(self.get_all_sensors())))
-        _network_counter, _station_counter, _sensor_counter = [], [], []
-        sensor_filename_segments = [
-            "network",
-            "station",
-            "variablename",
-            "depthfrom",
-            "depthto",
-            "sensorname",
-            "startdate",
-            "enddate",
-            "path",
-        ]
-        for p, pth in enumerate(self.get_all_sensors()):
-            segments = self.get_path_segments(pth)
-            _network, _station = (
-                segments[-3],
-                segments[-2],
+    @timeit
+    def make_sensor_ids(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> tuple[dict, dict, pd.DataFrame]:
+        """Assigns an ID of the form n<network>s<station>d<sensor> to every sensor \
+            and describes the sensors by the segments of their filenames and the \
+            coordinates and elevation of their .stm headers, see read_headers. \
+            The table is built with polars ("sensor_pl", backed by Arrow); \
+            "sensor_df" is its numpy-backed pandas copy.
+        :param n_cores: The number of workers used to read the .stm headers, \
+            by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The dictionaries from path to ID and back, and "sensor_df"
+        :rtype: tuple[dict, dict, pd.DataFrame]
+        """
+        sensor_keys = [self.sensor_key(pth) for pth in self.get_all_sensors()]
+        segments = pl.col("path").str.split("/")
+        filename = segments.list.get(-1).str.replace(r"\.stm$", "").str.split("_")
+
+        def first_seen(*columns: str) -> pl.Expr:
+            # the number of distinct values up to and including each row
+            return (
+                pl.concat_str(list(columns), separator="/")
+                .is_first_distinct()
+                .cum_sum()
             )
 
-            _sensor = segments[-1]
-            _sensor_enddate = _sensor.split("_")[-1].split(".stm")[0]
-            _sensor_startdate = _sensor.split("_")[-2]
-            _sensor_name = _sensor.split("_")[-3]
-            _sensor_dephto = _sensor.split("_")[-4]
-            _sensor_dephfrom = _sensor.split("_")[-5]
-            _sensor_variablename = _sensor.split("_")[-6]
-
-            _network_counter.append(_network)
-            _station_counter.append(f"{_network}_{_station}")
-            _sensor_counter.append(f"{_network}_{_station}_{_sensor}")
-
-            _network_counter_set, _station_counter_set, _sensor_counter_set = (
-                set(_network_counter),
-                set(_station_counter),
-                set(_sensor_counter),
+        self.sensor_pl = (
+            pl.DataFrame({"path": sensor_keys}, schema={"path": pl.Utf8})
+            .with_columns(
+                network=segments.list.get(-3),
+                station=segments.list.get(-2),
+                variablename=filename.list.get(-6),
+                depthfrom=filename.list.get(-5).cast(pl.Float64),
+                depthto=filename.list.get(-4).cast(pl.Float64),
+                sensorname=filename.list.get(-3),
+                startdate=filename.list.get(-2)
+                .str.strptime(pl.Date, "%Y%m%d")
+                .dt.strftime("%Y/%m/%d"),
+                enddate=filename.list.get(-1)
+                .str.strptime(pl.Date, "%Y%m%d")
+                .dt.strftime("%Y/%m/%d"),
             )
-
-            _sensor_ids_arr[p] = (
-                {
-                    sensor_filename_segments[0]: _network,
-                    sensor_filename_segments[1]: _station,
-                    sensor_filename_segments[2]: _sensor_variablename,
-                    sensor_filename_segments[3]: float(_sensor_dephfrom),
-                    sensor_filename_segments[4]: float(_sensor_dephto),
-                    sensor_filename_segments[5]: _sensor_name,
-                    sensor_filename_segments[6]: datetime.datetime.strptime(
-                        _sensor_startdate, "%Y%m%d"
-                    ).strftime("%Y/%m/%d"),
-                    sensor_filename_segments[7]: datetime.datetime.strptime(
-                        _sensor_enddate, "%Y%m%d"
-                    ).strftime("%Y/%m/%d"),
-                    sensor_filename_segments[8]: os.path.join(
-                        *self.get_path_segments(pth)[-4:]
-                    ),
-                },
-                f"n{str(len(_network_counter_set)).zfill(3)}s{str(len(_station_counter_set)).zfill(4)}d{str(len(_sensor_counter_set)).zfill(5)}",
+            .with_columns(
+                sensor_id=pl.format(
+                    "n{}s{}d{}",
+                    first_seen("network").cast(pl.Utf8).str.zfill(3),
+                    first_seen("network", "station").cast(pl.Utf8).str.zfill(4),
+                    first_seen("path").cast(pl.Utf8).str.zfill(5),
+                )
             )
+            .join(
+                pl.from_pandas(
+                    self.read_headers(n_cores, backend)[
+                        ["path", "latitude", "longitude", "elevation"]
+                    ]
+                ),
+                on="path",
+                how="left",
+            )
+            .select(
+                "sensor_id",
+                "network",
+                "station",
+                "latitude",
+                "longitude",
+                "elevation",
+                "variablename",
+                "depthfrom",
+                "depthto",
+                "sensorname",
+                "startdate",
+                "enddate",
+                "path",
+            )
+        )
 
-        self.sensor_id_to_path_dict = {
-            sensor_id: item["path"] for item, sensor_id in _sensor_ids_arr
-        }
+        sensor_ids = self.sensor_pl["sensor_id"].to_list()
+        metrics.count("sensors", len(sensor_ids))
+        self.sensor_id_to_path_dict = dict(zip(sensor_ids, sensor_keys))
 
         self.make_json(
             self.sensor_id_to_path_dict,
@@ -190,9 +1507,7 @@ class Tools:
             os.path.join(self.database_name, "json_dicts"),
         )
 
-        self.sensor_path_to_id_dict = {
-            item["path"]: sensor_id for item, sensor_id in _sensor_ids_arr
-        }
+        self.sensor_path_to_id_dict = dict(zip(sensor_keys, sensor_ids))
 
         self.make_json(
             self.sensor_path_to_id_dict,
@@ -200,14 +1515,15 @@ class Tools:
             os.path.join(self.database_name, "json_dicts"),
         )
 
-        _temp = {sensor_id: [*item.values()] for item, sensor_id in _sensor_ids_arr}
-
-        self.sensor_df = pd.DataFrame.from_dict(data=_temp, orient="index")
-        self.sensor_df.columns = sensor_filename_segments
+        self.sensor_df = self.to_pandas(self.sensor_pl, index="sensor_id")
 
         self.sensor_df.to_pickle(
             os.path.join(self.database_name, "json_dicts", "sensor_df.pkl")
         )
+        self.atomic_arrow(
+            self.sensor_pl,
+            os.path.join(self.database_name, "json_dicts", "sensor_df.arrow"),
+        )
 
         self.sensor_df.to_csv(
             os.path.join(self.database_name, "json_dicts", "sensor_df.csv")
@@ -215,6 +1531,42 @@ class Tools:
 
         return self.sensor_path_to_id_dict, self.sensor_id_to_path_dict, self.sensor_df
 
+    def pandas_view(
+        self, df: pl.DataFrame, index: Optional[str] = None
+    ) -> pd.DataFrame:
+        """Converts a polars table to pandas without copying, the columns being \
+            backed by the same Arrow buffers (pd.ArrowDtype). An opt-in alternative \
+            to "to_pandas", e.g. pandas_view(self.flag_pl, index="sensor_id").
+        :param df: The polars table
+        :type df: pl.DataFrame
+        :param index: A column to become the (unnamed) index, by default none
+        :type index: Optional[str]
+        :return: The Arrow-backed pandas dataframe
+        :rtype: pd.DataFrame
+        """
+        pandas_df = df.to_pandas(use_pyarrow_extension_array=True)
+        if index is not None:
+            pandas_df = pandas_df.set_index(index).rename_axis(None)
+
+        return pandas_df
+
+    def to_pandas(self, df: pl.DataFrame, index: Optional[str] = None) -> pd.DataFrame:
+        """Converts a polars table to a numpy-backed pandas dataframe, the form \
+            of the public (and pickled) "sensor_df" and "flag_df". The Arrow data \
+            stays available in the polars table itself, see "pandas_view".
+        :param df: The polars table
+        :type df: pl.DataFrame
+        :param index: A column to become the (unnamed) index, by default none
+        :type index: Optional[str]
+        :return: The pandas dataframe
+        :rtype: pd.DataFrame
+        """
+        pandas_df = df.to_pandas()
+        if index is not None:
+            pandas_df = pandas_df.set_index(index).rename_axis(None)
+
+        return pandas_df
+
     def get_network_from_filename(self, filename: str) -> str:
         return filename.split("/")[-1].split("_")[0]
 
@@ -223,11 +1575,10 @@ class Tools:
 
     def get_sensor_from_filename(self, filename: str) -> str:
         splitter = filename.split("/")[-1].split("_")
-        if splitter[-6] == "sm":
-            return f"{splitter[-3]}_soil_moisture_{splitter[-5]}_{splitter[-4]}"
-        else:
-            print("This is not an exclusive soil moisture data set")
+        variable = ISMN_VARIABLES.get(splitter[-6], splitter[-6])
+        return f"{splitter[-3]}_{variable}_{splitter[-5]}_{splitter[-4]}"
 
+    @timeit
     def get_all_numbers(
         self, database: MyDataTypes.IsmnDataBase
     ) -> tuple[int, int, int, dict, dict]:
@@ -250,7 +1601,7 @@ class Tools:
         stations_dict: dict = {}
         sensors_dict: dict = {}
 
-        for ii in trange(no_of_networks, desc="iterating over networks:"):
+        for ii in tqdm.trange(no_of_networks, desc="iterating over networks:"):
             network_name = network_lst[ii]
             try:
                 network = database[network_name]
@@ -277,6 +1628,7 @@ class Tools:
             stations_dict[network.name] = s + 1
 
         self._func_get_all_numbers_ran = True
+        metrics.count("sensors", no_of_sensors)
 
         self.no_of_networks = no_of_networks
         self.no_of_stations = no_of_stations
@@ -354,6 +1706,48 @@ class Tools:
         """
         return os.path.isdir(os.path.join(path, dir_name))
 
+    def atomic_pickle(self, df: pd.DataFrame, path: str) -> None:
+        """Pickles the dataframe to a temporary file first and then renames it, so \
+            that an interrupted write never leaves a truncated pickle behind.
+        :param df: The dataframe to be pickled
+        :type df: pd.DataFrame
+        :param path: The path of the pickle file
+        :type path: str
+        :return: None
+        :rtype: None
+        """
+        df.to_pickle(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def atomic_arrow(self, df: pl.DataFrame, path: str) -> None:
+        """Writes a polars table as an Arrow IPC file, through a temporary file \
+            like "atomic_pickle".
+        :param df: The polars table
+        :type df: pl.DataFrame
+        :param path: The path of the Arrow file
+        :type path: str
+        :return: None
+        :rtype: None
+        """
+        df.write_ipc(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def load_polars(self, pandas_df: pd.DataFrame, arrow_file: str) -> pl.DataFrame:
+        """Returns the polars table behind a pickled "sensor_df" or "flag_df": \
+            memory-mapped from its Arrow file if there is one, otherwise converted \
+            from the dataframe (caches written before the Arrow files existed).
+        :param pandas_df: The dataframe, indexed by sensor ID
+        :type pandas_df: pd.DataFrame
+        :param arrow_file: The path of the Arrow file
+        :type arrow_file: str
+        :return: The table, with the sensor IDs as first column "sensor_id"
+        :rtype: pl.DataFrame
+        """
+        if self.file_exists(arrow_file):
+            return pl.read_ipc(arrow_file, memory_map=True)
+
+        return pl.from_pandas(pandas_df.rename_axis("sensor_id").reset_index())
+
     def multi_dict(self, K: int, type: Any) -> defaultdict:
         """Create a multi-dimensional dictionary, based on a default dictionary.
         :param K: The number of dimensions
@@ -397,19 +1791,52 @@ class Geography(Tools):
         :return: The country name
         :rtype: str"""
 
-        from CoordPy import countries
+        return country_from_coords((latitude, longitude))
 
-        cc = countries.CountryChecker(
-            os.path.join("CoordPy", "TM_WORLD_BORDERS", "TM_WORLD_BORDERS-0.3.shp")
-        )
+    @timeit
+    def geocode_stations(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> dict:
+        """Looks up the countries of all sensors of every station. The coordinates \
+            are read from the .stm headers and each distinct coordinate is geocoded \
+            only once, in parallel.
+        :param n_cores: The number of workers, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The distinct countries of the sensors per "network:station"
+        :rtype: dict
+        """
+        header_df = self.read_headers(n_cores, backend)
+        station_coords = {
+            f"{network}:{station}": list(zip(sensors["latitude"], sensors["longitude"]))
+            for (network, station), sensors in header_df.groupby(["network", "station"])
+        }
 
-        try:
-            return cc.getCountry(countries.Point(latitude, longitude)).iso
+        unique_coords = list(
+            {
+                coords
+                for sensor_coords in station_coords.values()
+                for coords in sensor_coords
+            }
+        )
+        with Executor(  # point-in-polygon tests mostly run in Python
+            backend, n_cores, len(unique_coords), releases_gil=False
+        ) as executor:
+            countries = dict(
+                zip(unique_coords, executor.map(country_from_coords, unique_coords))
+            )
 
-        except AttributeError:
-            return "None"
+        return {
+            key: list({countries[coords] for coords in sensor_coords})
+            for key, sensor_coords in station_coords.items()
+        }
 
-    def sort_stations_to_countries(self) -> tuple[dict, dict]:
+    @timeit
+    def sort_stations_to_countries(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> tuple[dict, dict]:
         if not os.path.isfile(
             os.path.join(self.database_name, "json_dicts", "countries.json")
         ) and not os.path.isfile(
@@ -419,29 +1846,11 @@ class Geography(Tools):
             locations_dict = {}
             sorted_countries_dict = {}
 
+            station_countries = self.geocode_stations(n_cores, backend)
             for key, item in self.sensors_dict.items():
                 _network, _station = key.split(":")[0], key.split(":")[1]
-                _no_of_sensors = int(item)
-
-                counter = 0
-                _country = []
-                while counter < _no_of_sensors:
-                    lat = (
-                        self.database[_network][_station][counter]
-                        .metadata["latitude"]
-                        .val
-                    )
-                    long = (
-                        self.database[_network][_station][counter]
-                        .metadata["longitude"]
-                        .val
-                    )
-
-                    _country.append(self.get_country_from_coords(lat, long))
-
-                    counter += 1
 
-                _country = list(set(_country))
+                _country = station_countries.get(key, [])
                 if len(_country) == 1:
                     if _station not in locations_dict:
                         locations_dict[f"{key}"] = _country[0]
@@ -497,7 +1906,10 @@ class Geography(Tools):
         print("now i return")
         return self.countries_dict, self.locations_dict
 
-    def sort_stations_to_countries2(self) -> tuple[dict, dict]:
+    @timeit
+    def sort_stations_to_countries2(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> tuple[dict, dict]:
         if not os.path.isfile(
             os.path.join(self.database_name, "json_dicts", "countries.json")
         ) and not os.path.isfile(
@@ -507,29 +1919,11 @@ class Geography(Tools):
             locations_dict = {}
             sorted_countries_dict = {}
 
+            station_countries = self.geocode_stations(n_cores, backend)
             for key, item in self.sensors_dict.items():
                 _network, _station = key.split(":")[0], key.split(":")[1]
-                _no_of_sensors = int(item)
-
-                counter = 0
-                _country = []
-                while counter < _no_of_sensors:
-                    lat = (
-                        self.database[_network][_station][counter]
-                        .metadata["latitude"]
-                        .val
-                    )
-                    long = (
-                        self.database[_network][_station][counter]
-                        .metadata["longitude"]
-                        .val
-                    )
-
-                    _country.append(self.get_country_from_coords(lat, long))
 
-                    counter += 1
-
-                _country = list(set(_country))
+                _country = station_countries.get(key, [])
                 if len(_country) == 1:
                     if _station not in locations_dict:
                         locations_dict[f"{key}"] = _country[0]
@@ -601,7 +1995,7 @@ class DataReader(Tools):
         if not self.directory_exist_status(
             "json_dicts", os.path.join(os.getcwd(), self.database_name)
         ):
-            os.mkdir(os.path.join(os.getcwd(), self.database_name, "json_dicts"))
+            os.makedirs(os.path.join(os.getcwd(), self.database_name, "json_dicts"))
 
         if self.file_exists("numbers.json", os.path.join(os.getcwd(), "json_dicts")):
             self.numbers_dict = self.read_json(
@@ -684,120 +2078,142 @@ class Flags(DataReader):
 
     def __init__(self, database: Any, process_parallel: Optional[bool] = True) -> None:
         self.available_soil_moisture_flags = [
-            "C01",
-            "C02",
-            "C03",
-            "D01",
-            "D02",
-            "D03",
-            "D04",
-            "D05",
-            "D06",
-            "D07",
-            "D08",
-            "D09",
-            "D10",
-            "G",
+            kind for kind in SoilMoistureFlag.codes() if kind != "M"
         ]
-        self.faulty_soil_moisture_flags = ["M", "OK"]
+        self.faulty_soil_moisture_flags = ["M", *IGNORED_FLAG_TOKENS]
 
         super().__init__(database, process_parallel)
 
+    @property
+    def flag_df(self) -> pd.DataFrame:
+        return self._flag_df
+
+    @flag_df.setter
+    def flag_df(self, flag_df: pd.DataFrame) -> None:
+        self._flag_df = flag_df
+        self._rollup_cache = {}
+        self._flag_query = None
+
     @timeit
-    def make_flag_dict(self):
+    def make_flag_dict(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> None:
+        """Counts the soil moisture flags of every sensor loaded by the ISMN module \
+            into the nested "flag_dict" (network, station, sensor, flag) and saves it \
+            as "flag_dict.bin", see write_flag_dict. When loaded from there, \
+            "flag_dict" is a FlagDictFile that reads the networks on demand. \
+            An existing "flag_dict.json" is converted. Unknown flags are listed in \
+            "faulty_flags.txt".
+        :param n_cores: The number of workers reading the sensors, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: None
+        :rtype: None
+        """
         faulty_flag_file = os.path.join(self.database_name, "faulty_flags.txt")
         if os.path.isfile(faulty_flag_file):
             os.remove(faulty_flag_file)
             with open(faulty_flag_file, "w") as fff:
                 fff.write("flag_string\tfaulty_part\tnetwork\tstation\tsensor\n")
 
-        if self.file_exists(
-            os.path.join(self.database_name, "json_dicts", "flag_dict.json")
-        ):
-            print("flag_dict.json exists")
-            with open(
-                os.path.join(self.database_name, "json_dicts", "flag_dict.json")
-            ) as json_file:
+        flag_dict_file = os.path.join(
+            self.root, self.database_name, "json_dicts", "flag_dict.bin"
+        )
+        flag_dict_json = os.path.join(
+            self.root, self.database_name, "json_dicts", "flag_dict.json"
+        )
+        if self.file_exists(flag_dict_file):
+            with open(flag_dict_file, "rb") as bin_file:
+                outdated = bin_file.read(len(FlagDictFile.magic)) != FlagDictFile.magic
+            if outdated:
+                print("flag_dict.bin has an outdated format and is rebuilt")
+                os.remove(flag_dict_file)
+
+        if self.file_exists(flag_dict_file):
+            print("flag_dict.bin exists")
+            self.flag_dict = self.flag_dict_file = FlagDictFile(flag_dict_file)
+
+        elif self.file_exists(flag_dict_json):
+            print("flag_dict.json exists, converting it to flag_dict.bin")
+            with open(flag_dict_json) as json_file:
                 self.flag_dict = json.load(json_file)
+            write_flag_dict(self.flag_dict, flag_dict_file)
+            self.flag_dict_file = FlagDictFile(flag_dict_file)
 
         else:
-            print("flag_dict.json does not exist")
+            print("flag_dict.bin does not exist")
             self.flag_dict = self.multi_dict(4, dict)
-            for network, station, sensor in self.database.collection.iter_sensors():
-                # print(network.name, station.name, sensor.name)
-
-                sensor_flag_dict_entangled = (
-                    sensor.data["soil_moisture_flag"]
-                    .value_counts(ascending=False)
-                    .to_dict()
+            sensors = [
+                (network.name, station.name, sensor)
+                for network, station, sensor in self.database.collection.iter_sensors()
+            ]
+            with Executor(backend, n_cores, len(sensors)) as executor:
+                results = executor.imap_unordered(
+                    partial(
+                        sensor_flag_dict,
+                        flags=tuple(self.available_soil_moisture_flags),
+                    ),
+                    sensors,
                 )
-                sensor_flag_dict_disentangled = defaultdict(int)
-
-                for key, item in sensor_flag_dict_entangled.items():
-                    if (
-                        "," not in key
-                        and " " not in key
-                        and key in self.available_soil_moisture_flags
-                    ):
-                        sensor_flag_dict_disentangled[key] += int(item)
-
-                    elif "," in key and " " not in key:
-                        for splitter in key.split(","):
-                            if splitter.strip() in self.available_soil_moisture_flags:
-                                sensor_flag_dict_disentangled[splitter.strip()] += int(
-                                    item
-                                )
+                for network, station, sensor, flag_counts, faulty_parts in results:
+                    self.flag_dict[network][station][sensor] = flag_counts
 
-                            elif (
-                                splitter.strip() not in self.faulty_soil_moisture_flags
-                            ):
-                                with open(faulty_flag_file, "a") as fff:
-                                    fff.write(
-                                        f"{key}\t{splitter}\t{network.name}\t{station.name}\t{sensor.name}\n"
-                                    )
-
-                    elif " " in key and "," not in key:
-                        for splitter in key.split(" "):
-                            if splitter in self.available_soil_moisture_flags:
-                                sensor_flag_dict_disentangled[splitter] += int(item)
-
-                            elif splitter not in self.faulty_soil_moisture_flags:
-                                with open(faulty_flag_file, "a") as fff:
-                                    fff.write(
-                                        f"{key}\t{splitter}\t{network.name}\t{station.name}\t{sensor.name}\n"
-                                    )
-
-                    else:
+                    for key, splitter in faulty_parts:
                         with open(faulty_flag_file, "a") as fff:
                             fff.write(
-                                f"{key}\t{key}\t{network.name}\t{station.name}\t{sensor.name}\n"
+                                f"{key}\t{splitter}\t{network}\t{station}\t{sensor}\n"
                             )
 
-                sensor_flag_dict_disentangled = dict(
-                    sorted(
-                        sensor_flag_dict_disentangled.items(),
-                        key=lambda item: item[1],
-                        reverse=True,
-                    )
-                )
-
-                self.flag_dict[network.name][station.name][
-                    sensor.name
-                ] = sensor_flag_dict_disentangled
-
-            self.make_json(
-                dict(self.flag_dict),
-                "flag_dict.json",
-                os.path.join(self.database_name, "json_dicts"),
-            )
+            write_flag_dict(self.flag_dict, flag_dict_file)
+            self.flag_dict_file = FlagDictFile(flag_dict_file)
 
         if not os.path.isfile(faulty_flag_file):
             print("\n\n\There were no faulty flags identified in the database\n\n")
 
     @timeit
     def get_flag_df(
-        self, n_cores: Optional[int] = 8, save_as_csv: Optional[False] = False
+        self,
+        n_cores: Optional[int] = 8,
+        save_as_csv: Optional[False] = False,
+        streaming: Optional[bool] = True,
+        max_memory_mb: Optional[int] = None,
+        backend: Optional[str] = "auto",
+        io_threads: Optional[int] = 0,
+        queue_depth: Optional[int] = 16,
     ) -> pd.DataFrame:
+        """Counts the flags of every sensor in the database. The counts are \
+            collected in a polars dataframe ("flag_pl", backed by Arrow); "flag_df" \
+            is its numpy-backed pandas copy. The result is pickled to "flag_df.pkl" \
+            (and "flag_pl" written to "flag_df.arrow") and loaded from there on \
+            subsequent calls.
+        :param n_cores: The number of workers used to read the .stm files, by default 8
+        :type n_cores: Optional[int]
+        :param save_as_csv: If True, the dataframe is additionally saved as \
+            "flag_df.csv", by default False
+        :type save_as_csv: Optional[False]
+        :param streaming: If True, per-sensor counts are consumed as they arrive \
+            from the workers; otherwise each network is read as one batch, \
+            by default True
+        :type streaming: Optional[bool]
+        :param max_memory_mb: In streaming mode, the maximum size of the .stm files \
+            being read at the same time in MB, by default unlimited
+        :type max_memory_mb: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :param io_threads: In streaming mode, the number of threads reading the \
+            .stm files ahead of the parsing workers, by default 0 (the workers read \
+            the files themselves). Useful on network storage, best combined with \
+            the "threads" backend, as prefetched files are not pickled then
+        :type io_threads: Optional[int]
+        :param queue_depth: The maximum number of prefetched batches of files \
+            waiting to be parsed, by default 16
+        :type queue_depth: Optional[int]
+        :return: The number of occurrences of every flag per sensor ID
+        :rtype: pd.DataFrame
+        """
         if self.file_exists(
             os.path.join(self.root, self.database_name, "json_dicts", "flag_df.pkl")
         ):
@@ -805,6 +2221,12 @@ class Flags(DataReader):
             self.flag_df = pd.read_pickle(
                 os.path.join(self.root, self.database_name, "json_dicts", "flag_df.pkl")
             )
+            self.flag_pl = self.load_polars(
+                self.flag_df,
+                os.path.join(
+                    self.root, self.database_name, "json_dicts", "flag_df.arrow"
+                ),
+            )
 
         else:
             print(os.getcwd())
@@ -812,45 +2234,194 @@ class Flags(DataReader):
                 "\nConstructing and subsequently pickling the dataframe. This might take some time, but is only done once."
             )
 
-            self.make_sensor_ids()
+            with metrics.span("id_building"):
+                self.make_sensor_ids(n_cores, backend)
 
-            def multi_reader() -> dict:
-                pool = Pool(n_cores)  # number of cores you want to use
-
-                sensor_list = self.get_all_sensors()
-                all_flags_list = [
-                    flags.to_series(0).to_list()
-                    for flags in pool.map(flag_reader, sensor_list)
-                ]  # creates a list of the loaded df's
-                # all_flags_dict = {'Soil_Moisture_Flags': self.available_soil_moisture_flags}
-                all_flags_dict = {}
-
-                for flags, filename in zip(all_flags_list, sensor_list):
-                    _temp_dict = {key: 0 for key in self.available_soil_moisture_flags}
-                    for flag in flags:
-                        if "," in flag:
-                            split_flag = flag.split(",")
-                            for splitter in split_flag:
-                                _temp_dict[splitter] += 1
-                        else:
-                            _temp_dict[flag] += 1
+            checkpoint_dir = os.path.join(
+                self.root, self.database_name, "json_dicts", "flag_df_checkpoints"
+            )
+            if not os.path.isdir(checkpoint_dir):
+                os.mkdir(checkpoint_dir)
+
+            bits = [
+                SoilMoistureFlag(flag).bit
+                for flag in self.available_soil_moisture_flags
+            ]
 
-                    filename = filename.split(self.root)[1][1:]
-                    sensor_id = self.sensor_path_to_id_dict[filename]
-                    all_flags_dict[sensor_id] = list(_temp_dict.values())
+            def counts_to_df(counts: dict, network_sensors: list) -> pl.DataFrame:
+                network_counts = np.stack(
+                    [counts[filename][bits] for filename in network_sensors]
+                )
+                metrics.count("flags", int(network_counts.sum()))
+
+                return pl.DataFrame(
+                    {
+                        "sensor_id": [
+                            self.sensor_path_to_id_dict[self.sensor_key(filename)]
+                            for filename in network_sensors
+                        ],
+                        **{
+                            flag: network_counts[:, j]
+                            for j, flag in enumerate(self.available_soil_moisture_flags)
+                        },
+                    }
+                )
 
-                flags_df = pd.DataFrame.from_dict(data=all_flags_dict, orient="index")
-                cols = self.available_soil_moisture_flags
-                flags_df.columns = cols
-                # flags_df = flags_df[1:]
-                # flags_df = flags_df.set_index('Soil_Moisture_Flags')
+            busy_per_worker = defaultdict(float)
+
+            def network_reader(pool: Executor, pending: dict) -> Iterator:
+                for network, network_sensors in pending.items():
+                    sizes = {
+                        filename: sensor_file_size(filename)
+                        for filename in network_sensors
+                    }
+                    counts = {}
+                    for pid, busy, results in pool.map(
+                        flag_batch_counter,
+                        schedule_tasks(network_sensors, sizes, n_cores),
+                        chunksize=1,
+                    ):
+                        busy_per_worker[pid] += busy
+                        counts.update(results)
+                        metrics.count("files", len(results))
+                        metrics.count("bytes", sum(sizes[f] for f, _ in results))
+
+                    yield network, counts_to_df(counts, network_sensors)
+
+            def stream_reader(pool: Executor, pending: dict) -> Iterator:
+                network_of = {
+                    filename: network
+                    for network, network_sensors in pending.items()
+                    for filename in network_sensors
+                }
+                sizes = {
+                    filename: sensor_file_size(filename) for filename in network_of
+                }
+                remaining = {
+                    network: len(network_sensors)
+                    for network, network_sensors in pending.items()
+                }
+                counts = defaultdict(dict)
+                budget = MemoryBudget(
+                    max_memory_mb * 1024**2 if max_memory_mb is not None else None
+                )
 
-                return flags_df
+                def tasks() -> Iterator:
+                    # one network after the other, so that every network is
+                    # complete, and checkpointed, as early as possible
+                    network_bytes = {
+                        network: sum(map(sizes.__getitem__, network_sensors))
+                        for network, network_sensors in pending.items()
+                    }
+                    batches = [
+                        batch
+                        for network in sorted(
+                            pending, key=network_bytes.__getitem__, reverse=True
+                        )
+                        for batch in schedule_tasks(pending[network], sizes, n_cores)
+                    ]
+                    if not io_threads:
+                        for batch in batches:
+                            if not budget.acquire(sum(map(sizes.__getitem__, batch))):
+                                return
+                            yield batch
+                        return
+
+                    # the read-ahead charges the budget for every batch it holds,
+                    # the charge is released with the results of the batch
+                    prefetched = prefetch_files(
+                        batches, io_threads, queue_depth, budget
+                    )
+                    try:
+                        yield from prefetched
+                    finally:
+                        prefetched.close()
 
-            self.flag_df = multi_reader()
-            self.flag_df.to_pickle(
-                os.path.join(self.database_name, "json_dicts", "flag_df.pkl")
-            )
+                try:
+                    for pid, busy, results in pool.imap_unordered(
+                        flag_batch_counter, tasks()
+                    ):
+                        busy_per_worker[pid] += busy
+                        batch_bytes = sum(sizes[f] for f, _ in results)
+                        budget.release(batch_bytes)
+                        metrics.count("files", len(results))
+                        metrics.count("bytes", batch_bytes)
+                        for filename, _counts in results:
+                            network = network_of[filename]
+                            counts[network][filename] = _counts
+                            remaining[network] -= 1
+                            if remaining[network] == 0:
+                                yield network, counts_to_df(
+                                    counts.pop(network), pending[network]
+                                )
+                finally:
+                    budget.close()
+
+            def multi_reader() -> pd.DataFrame:
+                sensors_per_network = defaultdict(list)
+                with metrics.span("discovery"):
+                    for sensor_path in self.get_all_sensors():
+                        sensors_per_network[
+                            self.get_path_segments(sensor_path)[-3]
+                        ].append(sensor_path)
+
+                partial_dfs = {}
+                pending = {}
+                for network, network_sensors in sensors_per_network.items():
+                    checkpoint = os.path.join(checkpoint_dir, f"{network}.arrow")
+                    if self.file_exists(checkpoint):
+                        print(f"Resuming from the checkpoint of network {network}")
+                        partial_dfs[network] = pl.read_ipc(checkpoint, memory_map=False)
+                    else:
+                        pending[network] = network_sensors
+
+                reader = stream_reader if streaming else network_reader
+                n_tasks = sum(map(len, pending.values()))
+                with metrics.span("reading"):
+                    # polars parses outside of the GIL
+                    with Executor(backend, n_cores, n_tasks) as pool:
+                        for network, partial_df in reader(pool, pending):
+                            partial_dfs[network] = partial_df
+                            self.atomic_arrow(
+                                partial_df,
+                                os.path.join(checkpoint_dir, f"{network}.arrow"),
+                            )
+
+                return pl.concat(
+                    [partial_dfs[network] for network in sensors_per_network]
+                )
+
+            start_time = time.perf_counter()
+            self.flag_pl = multi_reader()
+            self.flag_df = self.to_pandas(self.flag_pl, index="sensor_id")
+            wall_time = time.perf_counter() - start_time
+
+            self.worker_utilization = {
+                pid: busy / wall_time for pid, busy in busy_per_worker.items()
+            }
+            if self.worker_utilization:
+                print(
+                    f"Worker utilization over {wall_time:.1f} seconds: "
+                    + ", ".join(
+                        f"{pid}: {utilization:.0%}"
+                        for pid, utilization in sorted(self.worker_utilization.items())
+                    )
+                )
+            with metrics.span("pickling"):
+                self.atomic_pickle(
+                    self.flag_df,
+                    os.path.join(
+                        self.root, self.database_name, "json_dicts", "flag_df.pkl"
+                    ),
+                )
+                self.atomic_arrow(
+                    self.flag_pl,
+                    os.path.join(
+                        self.root, self.database_name, "json_dicts", "flag_df.arrow"
+                    ),
+                )
+            metrics.count("rows", len(self.flag_df))
+            shutil.rmtree(checkpoint_dir)
 
         if save_as_csv:
             print('Additionally saving dataframe to "flag_df.csv".')
@@ -860,6 +2431,2032 @@ class Flags(DataReader):
 
         return self.flag_df
 
+    @timeit
+    def approximate_flag_df(
+        self,
+        target_precision: Optional[float] = 0.01,
+        time_budget: Optional[float] = 10.0,
+        confidence: Optional[float] = 0.95,
+        blocks_per_sensor: Optional[int] = 8,
+        block_bytes: Optional[int] = 4096,
+        n_cores: Optional[int] = 8,
+        backend: Optional[str] = "auto",
+        seed: Optional[int] = 0,
+    ) -> dict:
+        """Estimates the fraction of observations carrying each flag from random \
+            blocks of rows of a random subset of sensors, see flag_block_sampler. \
+            Sensors are added in rounds of doubling size until the confidence \
+            intervals of the whole database are narrower than the target precision, \
+            the time budget is spent or all sensors are sampled. A round is capped \
+            at the number of sensors that the throughput of the previous round \
+            fits into the remaining time budget. Zip members cannot seek, so their \
+            blocks are read by decompressing the member once up to the last block: \
+            in zip mode sampling saves the parsing, not the decompression.
+        :param target_precision: The aimed half-width of the confidence intervals \
+            of the database fractions, by default 0.01
+        :type target_precision: Optional[float]
+        :param time_budget: The maximum time in seconds, checked after every \
+            sampled sensor, by default 10
+        :type time_budget: Optional[float]
+        :param confidence: The confidence level of the intervals, by default 0.95
+        :type confidence: Optional[float]
+        :param blocks_per_sensor: The number of blocks read per sensor, by default 8
+        :type blocks_per_sensor: Optional[int]
+        :param block_bytes: The size of a block in bytes, by default 4096
+        :type block_bytes: Optional[int]
+        :param n_cores: The number of workers, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :param seed: The seed of the sensor selection and block offsets, by default 0
+        :type seed: Optional[int]
+        :return: For "sensor", "network" and "database", a dataframe with the \
+            columns ("fraction", flag), ("ci_low", flag) and ("ci_high", flag)
+        :rtype: dict
+        """
+        if not hasattr(self, "sensor_path_to_id_dict"):
+            self.make_sensor_ids()
+
+        start_time = time.perf_counter()
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        flags = self.available_soil_moisture_flags
+        columns = [SoilMoistureFlag.codes().index(flag) for flag in flags]
+        rng = np.random.default_rng(seed)
+        sensor_list = self.get_all_sensors()
+        order = rng.permutation(len(sensor_list))
+        network_sizes = pd.Series(
+            [self.get_path_segments(p)[-3] for p in sensor_list]
+        ).value_counts()
+
+        def sensor_estimates(samples: list) -> pd.DataFrame:
+            fractions, variances, weights = [], [], []
+            for _, counts, rows, estimated_rows, complete in samples:
+                counts = counts[:, columns]
+                fraction = counts.sum(axis=0) / max(rows.sum(), 1)
+                n = len(rows)
+                if complete:
+                    variance = np.zeros(len(flags))
+                elif n > 1 and rows.sum() > 0:
+                    # ratio estimator over the blocks as clusters
+                    residuals = counts - fraction * rows[:, None]
+                    variance = (residuals**2).sum(axis=0) / (
+                        n * (n - 1) * rows.mean() ** 2
+                    )
+                else:
+                    variance = fraction * (1 - fraction) / max(rows.sum(), 1)
+                fractions.append(fraction)
+                variances.append(variance)
+                weights.append(estimated_rows)
+
+            index = [
+                self.sensor_path_to_id_dict[self.sensor_key(p)] for p, *_ in samples
+            ]
+            return (
+                pd.DataFrame(fractions, index=index, columns=flags),
+                pd.DataFrame(variances, index=index, columns=flags),
+                pd.Series(weights, index=index),
+                pd.Series(
+                    [self.get_path_segments(p)[-3] for p, *_ in samples], index=index
+                ),
+            )
+
+        def group_estimate(
+            fractions: pd.DataFrame,
+            variances: pd.DataFrame,
+            weights: pd.Series,
+            n_total: int,
+        ) -> tuple[pd.Series, pd.Series]:
+            total = weights.sum()
+            # sensors without any estimated rows count equally instead of
+            # dividing by zero
+            w = weights / total if total > 0 else weights * 0 + 1 / len(weights)
+            fraction = fractions.mul(w, axis=0).sum()
+            n = len(w)
+            within = variances.mul(w**2, axis=0).sum()
+            between = (
+                (fractions - fraction).pow(2).mul(w**2, axis=0).sum() * n / (n - 1)
+                if n > 1
+                else fraction * 0
+            )
+            return fraction, within + (1 - n / n_total) * between
+
+        samples = []
+        sampled = 0
+        round_size = max(4 * n_cores, 32)
+        deadline = start_time + time_budget
+        sampler = partial(
+            flag_block_sampler,
+            n_blocks=blocks_per_sensor,
+            block_bytes=block_bytes,
+            seed=seed,
+        )
+        with Executor(backend, n_cores, len(sensor_list)) as executor:
+            while sampled < len(sensor_list):
+                batch = [sensor_list[i] for i in order[sampled : sampled + round_size]]
+                # a few sensors per worker in flight, so that no new work is
+                # handed out once the deadline has passed
+                in_flight = MemoryBudget(2 * n_cores)
+
+                def tasks() -> Iterator:
+                    for sensor_path in batch:
+                        if not in_flight.acquire(1) or time.perf_counter() > deadline:
+                            return
+                        yield sensor_path
+
+                round_start = time.perf_counter()
+                n_before = len(samples)
+                try:
+                    for sample in executor.imap_unordered(sampler, tasks()):
+                        in_flight.release(1)
+                        samples.append(sample)
+                        if time.perf_counter() > deadline:
+                            break
+                finally:
+                    in_flight.close()
+                n_done = len(samples) - n_before
+                sampled += n_done
+                metrics.count("files", n_done)
+                if not samples:
+                    raise ValueError("No sensor was sampled within the time budget")
+
+                fractions, variances, weights, networks = sensor_estimates(samples)
+                fraction, variance = group_estimate(
+                    fractions, variances, weights, len(sensor_list)
+                )
+                half_width = z * np.sqrt(variance.max())
+                print(
+                    f"{sampled}/{len(sensor_list)} sensors sampled, "
+                    f"confidence interval +/- {half_width:.4f}"
+                )
+                if half_width <= target_precision:
+                    break
+                now = time.perf_counter()
+                throughput = n_done / max(now - round_start, 1e-9)
+                round_size = min(2 * round_size, int(throughput * (deadline - now)))
+                if n_done < len(batch) or round_size < 1:
+                    print("The time budget is spent")
+                    break
+
+        def with_intervals(
+            fraction: pd.DataFrame, variance: pd.DataFrame
+        ) -> pd.DataFrame:
+            half_width = z * np.sqrt(variance)
+            return pd.concat(
+                {
+                    "fraction": fraction,
+                    "ci_low": (fraction - half_width).clip(lower=0),
+                    "ci_high": (fraction + half_width).clip(upper=1),
+                },
+                axis=1,
+            )
+
+        network_estimates = {
+            network: group_estimate(
+                fractions.loc[sensors],
+                variances.loc[sensors],
+                weights.loc[sensors],
+                network_sizes[network],
+            )
+            for network, sensors in networks.groupby(networks).groups.items()
+        }
+        self.approximate_flags = {
+            "sensor": with_intervals(fractions, variances),
+            "network": with_intervals(
+                pd.DataFrame({n: f for n, (f, _) in network_estimates.items()}).T,
+                pd.DataFrame({n: v for n, (_, v) in network_estimates.items()}).T,
+            ),
+            "database": with_intervals(
+                fraction.to_frame(self.database_name).T,
+                variance.to_frame(self.database_name).T,
+            ),
+        }
+
+        return self.approximate_flags
+
+    @timeit
+    def get_flag_tables(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> dict:
+        """Splits the flag counts of "flag_df", which covers the sensors of all \
+            variables, into one table per variable and pickles each of them to \
+            "flag_df_<variable>.pkl". A table holds the flags of the vocabulary of \
+            its variable plus any other flag that actually occurs.
+        :param n_cores: The number of workers used to read the .stm files if \
+            "flag_df" does not exist yet, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The flag table of every variable, keyed by its abbreviation
+        :rtype: dict
+        """
+        if not hasattr(self, "flag_df"):
+            self.get_flag_df(n_cores=n_cores, backend=backend)
+
+        variables = self._get_sensor_df().loc[self.flag_df.index, "variablename"]
+        self.flag_tables = {}
+        for variable, sensor_ids in variables.groupby(
+            variables, sort=False
+        ).groups.items():
+            flag_table = self.flag_df.loc[sensor_ids]
+            occurring = flag_table.columns[flag_table.to_numpy().sum(axis=0) > 0]
+            vocabulary = set(flag_vocabulary(variable)).union(occurring)
+            self.flag_tables[variable] = flag_table[
+                [flag for flag in flag_table.columns if flag in vocabulary]
+            ]
+            self.atomic_pickle(
+                self.flag_tables[variable],
+                os.path.join(
+                    self.root,
+                    self.database_name,
+                    "json_dicts",
+                    f"flag_df_{variable}.pkl",
+                ),
+            )
+
+        return self.flag_tables
+
+    def _get_sensor_df(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> pd.DataFrame:
+        if not hasattr(self, "sensor_df"):
+            sensor_df_file = os.path.join(
+                self.root, self.database_name, "json_dicts", "sensor_df.pkl"
+            )
+            if self.file_exists(sensor_df_file):
+                self.sensor_df = pd.read_pickle(sensor_df_file)
+                self.sensor_pl = self.load_polars(
+                    self.sensor_df, sensor_df_file.replace(".pkl", ".arrow")
+                )
+            if "latitude" not in getattr(self, "sensor_df", {}):
+                if hasattr(self, "sensor_df"):
+                    print("sensor_df.pkl has no coordinates and is rebuilt")
+                self.make_sensor_ids(n_cores, backend)
+
+        return self.sensor_df
+
+    def flag_rollup(
+        self, level: Optional[str] = "network", fractions: Optional[bool] = False
+    ) -> pd.DataFrame:
+        """Sums the flags of "flag_df" into the categories C, D-geophysical, \
+            D-spectrum and dynamic and aggregates them per sensor, station, network \
+            or country. Results are memoized until a new "flag_df" is assigned; \
+            every call returns a copy of the memoized table.
+        :param level: One of "sensor", "station", "network" or "country", \
+            by default "network". The country level requires "locations.json", \
+            see Geography.sort_stations_to_countries
+        :type level: Optional[str]
+        :param fractions: If True, each category is divided by the total number of \
+            flag occurrences of its row instead of being returned as a count, \
+            by default False
+        :type fractions: Optional[bool]
+        :return: One column per category plus the column "total"
+        :rtype: pd.DataFrame
+        """
+        if not hasattr(self, "flag_df"):
+            self.get_flag_df()
+
+        if (level, fractions) in self._rollup_cache:
+            return self._rollup_cache[(level, fractions)].copy()
+
+        categories = list(FLAG_CATEGORIES)
+        membership = np.array(
+            [
+                [
+                    SoilMoistureFlag(flag).category == FLAG_CATEGORIES[category]
+                    for category in categories
+                ]
+                for flag in self.flag_df.columns
+            ],
+            dtype=np.int64,
+        )
+        counts = self.flag_df.to_numpy(dtype=np.int64)
+        rollup = pd.DataFrame(
+            counts @ membership, index=self.flag_df.index, columns=categories
+        )
+        rollup["total"] = counts.sum(axis=1)
+
+        if level != "sensor":
+            sensor_df = self._get_sensor_df().loc[rollup.index]
+            if level == "station":
+                keys = [sensor_df["network"], sensor_df["station"]]
+            elif level == "network":
+                keys = [sensor_df["network"]]
+            elif level == "country":
+                locations_file = os.path.join(
+                    self.root, self.database_name, "json_dicts", "locations.json"
+                )
+                if not self.file_exists(locations_file):
+                    raise ValueError(
+                        f'The country rollup requires "{locations_file}", \
+                            run Geography.sort_stations_to_countries first.'
+                    )
+                locations_dict = self.read_json(locations_file)
+                keys = [
+                    (sensor_df["network"] + ":" + sensor_df["station"])
+                    .map(locations_dict)
+                    .fillna("Unknown")
+                    .rename("country")
+                ]
+            else:
+                raise ValueError(
+                    f'The level "{level}" is none of "sensor", "station", \
+                        "network" or "country".'
+                )
+            rollup = rollup.groupby(keys).sum()
+
+        if fractions:
+            rollup[categories] = rollup[categories].div(
+                rollup["total"].where(rollup["total"] > 0), axis=0
+            )
+
+        self._rollup_cache[(level, fractions)] = rollup
+        return rollup.copy()
+
+    def flag_query(self) -> "FlagQuery":
+        """Returns the query engine over the flag fractions of "flag_df", built once \
+            per "flag_df". Queries can be restricted by network, station and, \
+            if "locations.json" exists, by country.
+        :return: The query engine
+        :rtype: FlagQuery
+        """
+        if not hasattr(self, "flag_df"):
+            self.get_flag_df()
+
+        if self._flag_query is None:
+            if not hasattr(self, "sensor_id_to_path_dict"):
+                self.make_sensor_ids()
+
+            groups = self._get_sensor_df().loc[
+                self.flag_df.index, ["network", "station"]
+            ]
+            locations_file = os.path.join(
+                self.root, self.database_name, "json_dicts", "locations.json"
+            )
+            if self.file_exists(locations_file):
+                groups["country"] = (
+                    (groups["network"] + ":" + groups["station"])
+                    .map(self.read_json(locations_file))
+                    .fillna("Unknown")
+                )
+            self._flag_query = FlagQuery(
+                self.flag_df, self.sensor_id_to_path_dict, groups
+            )
+
+        return self._flag_query
+
+    @timeit
+    def make_quality_timelines(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> "QualityTimelines":
+        """Compresses the flag sequence of every sensor into run-length segments \
+            of (start, end, bitmask) and stores them in "quality_timelines.npz".
+        :param n_cores: The number of workers used to read the .stm files, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The quality timelines of all sensors in the database
+        :rtype: QualityTimelines
+        """
+        timelines_file = os.path.join(
+            self.root, self.database_name, "json_dicts", "quality_timelines.npz"
+        )
+        if self.file_exists(timelines_file):
+            print("quality_timelines.npz exists")
+            return QualityTimelines(timelines_file)
+
+        if not hasattr(self, "sensor_path_to_id_dict"):
+            self.make_sensor_ids()
+
+        sensor_list = self.get_all_sensors()
+        with Executor(backend, n_cores, len(sensor_list)) as executor:
+            encoded = executor.map(timeline_encoder, sensor_list)
+        count_sensor_files(sensor_list)
+        metrics.count("sensors", len(encoded))
+
+        sensor_ids = [
+            self.sensor_path_to_id_dict[self.sensor_key(sensor_path)]
+            for sensor_path, *_ in encoded
+        ]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(starts) for _, starts, _, _ in encoded])
+        # the runs of no sensor at all, so that an empty selection is stored too
+        no_runs = encode_flag_runs(np.empty(0), np.empty(0))
+
+        np.savez_compressed(
+            timelines_file,
+            sensor_ids=np.array(sensor_ids, dtype=str),
+            flag_codes=np.array(SoilMoistureFlag.codes()),
+            offsets=offsets,
+            starts=np.concatenate([no_runs[0], *(runs[1] for runs in encoded)]),
+            ends=np.concatenate([no_runs[1], *(runs[2] for runs in encoded)]),
+            masks=np.concatenate([no_runs[2], *(runs[3] for runs in encoded)]),
+        )
+
+        return QualityTimelines(timelines_file)
+
+    @timeit
+    def grid_flags(
+        self,
+        resolution: Optional[float] = 0.25,
+        extent: Optional[tuple] = (-90.0, 90.0, -180.0, 180.0),
+        store: Optional[str] = None,
+        n_cores: Optional[int] = 8,
+        backend: Optional[str] = "auto",
+    ) -> dict:
+        """Bins the flags of "flag_df" into the cells of a regular latitude/longitude \
+            grid by the coordinates in the .stm headers and writes the dense per-cell \
+            counts and fractions of every flag and category to an array store.
+        :param resolution: The cell size in degrees, by default 0.25
+        :type resolution: Optional[float]
+        :param extent: The grid bounds (min_latitude, max_latitude, min_longitude, \
+            max_longitude) in degrees, by default global. Sensors outside are dropped
+        :type extent: Optional[tuple]
+        :param store: The output, a ".nc" file (requires xarray) or a directory of \
+            .npy arrays, by default "json_dicts/flag_grid_<resolution>"
+        :type store: Optional[str]
+        :param n_cores: The number of workers used to read the .stm headers, \
+            by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The arrays "latitude", "longitude", "flag", "category", "n_sensors", \
+            "flag_count", "flag_fraction", "category_count" and "category_fraction", \
+            the latter four shaped (flag or category, latitude, longitude)
+        :rtype: dict
+        """
+        if store is None:
+            store = os.path.join(
+                self.root, self.database_name, "json_dicts", f"flag_grid_{resolution}"
+            )
+
+        min_lat, max_lat, min_lon, max_lon = extent
+        n_lat = int(np.ceil(round((max_lat - min_lat) / resolution, 9)))
+        n_lon = int(np.ceil(round((max_lon - min_lon) / resolution, 9)))
+
+        sensor_counts = self.flag_rollup("sensor")
+        categories = list(FLAG_CATEGORIES)
+        counts = np.hstack(
+            [
+                self.flag_df.to_numpy(dtype=np.int64),
+                sensor_counts[categories + ["total"]].to_numpy(dtype=np.int64),
+            ]
+        )
+
+        sensor_df = self._get_sensor_df(n_cores, backend).loc[self.flag_df.index]
+        latitudes = sensor_df["latitude"].to_numpy()
+        longitudes = sensor_df["longitude"].to_numpy()
+
+        rows = np.floor((latitudes - min_lat) / resolution)
+        cols = np.floor((longitudes - min_lon) / resolution)
+        # stations on the northern or eastern edge belong to the last cell
+        rows[latitudes == max_lat] = n_lat - 1
+        cols[longitudes == max_lon] = n_lon - 1
+        inside = (rows >= 0) & (rows < n_lat) & (cols >= 0) & (cols < n_lon)
+        if not inside.all():
+            print(f"{(~inside).sum()} sensors lie outside the grid extent")
+        cells = (rows[inside] * n_lon + cols[inside]).astype(np.int64)
+        metrics.count("sensors", int(inside.sum()))
+
+        # accumulate over the occupied cells only, then scatter into the dense grid
+        occupied, cell_index = np.unique(cells, return_inverse=True)
+        cell_counts = np.zeros((len(occupied), counts.shape[1]), dtype=np.int64)
+        np.add.at(cell_counts, cell_index, counts[inside])
+
+        dense = np.zeros((counts.shape[1], n_lat * n_lon), dtype=np.int64)
+        dense[:, occupied] = cell_counts.T
+        dense = dense.reshape(counts.shape[1], n_lat, n_lon)
+        n_sensors = np.zeros(n_lat * n_lon, dtype=np.int32)
+        n_sensors[occupied] = np.bincount(cell_index)
+
+        n_flags = len(self.flag_df.columns)
+        total = dense[-1].astype(np.float32)
+        total[total == 0] = np.nan
+        grid = {
+            "latitude": min_lat + (np.arange(n_lat) + 0.5) * resolution,
+            "longitude": min_lon + (np.arange(n_lon) + 0.5) * resolution,
+            "flag": np.array(self.flag_df.columns, dtype=str),
+            "category": np.array(categories),
+            "n_sensors": n_sensors.reshape(n_lat, n_lon),
+            "flag_count": dense[:n_flags],
+            "flag_fraction": dense[:n_flags] / total,
+            "category_count": dense[n_flags:-1],
+            "category_fraction": dense[n_flags:-1] / total,
+        }
+        write_array_store(grid, store)
+
+        return grid
+
+    @timeit
+    def recompute_spectrum_flags(
+        self,
+        qc: Optional["SpectrumQC"] = None,
+        n_cores: Optional[int] = 8,
+        backend: Optional[str] = "auto",
+    ) -> pd.DataFrame:
+        """Applies the spectrum based checks D06 to D10 to the series of every soil \
+            moisture sensor, independently of the flags assigned by the ISMN, and \
+            pickles the counts to "spectrum_flag_df.pkl".
+        :param qc: The checks and their thresholds, by default SpectrumQC()
+        :type qc: Optional[SpectrumQC]
+        :param n_cores: The number of workers used to read the .stm files, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The number of occurrences of every recomputed flag per sensor ID, \
+            in the format of "flag_df"
+        :rtype: pd.DataFrame
+        """
+        qc = qc if qc is not None else SpectrumQC()
+        if not hasattr(self, "sensor_path_to_id_dict"):
+            self.make_sensor_ids()
+
+        sensor_list = [
+            sensor_path
+            for sensor_path in self.get_all_sensors()
+            if self.get_path_segments(sensor_path)[-1].split("_")[-6] == "sm"
+        ]
+        with Executor(backend, n_cores, len(sensor_list)) as executor:
+            counts = executor.map(partial(spectrum_flag_counter, qc=qc), sensor_list)
+        count_sensor_files(sensor_list)
+        metrics.count("sensors", len(counts))
+
+        self.spectrum_flag_df = pd.DataFrame(
+            [sensor_counts for _, sensor_counts in counts],
+            index=[
+                self.sensor_path_to_id_dict[self.sensor_key(sensor_path)]
+                for sensor_path, _ in counts
+            ],
+            columns=qc.flags,
+        )
+        self.atomic_pickle(
+            self.spectrum_flag_df,
+            os.path.join(
+                self.root, self.database_name, "json_dicts", "spectrum_flag_df.pkl"
+            ),
+        )
+
+        return self.spectrum_flag_df
+
+    @timeit
+    def recompute_geophysical_flags(
+        self,
+        tolerance_minutes: Optional[int] = 60,
+        freezing_point: Optional[float] = 0.0,
+        max_depth_difference: Optional[float] = 0.05,
+        n_cores: Optional[int] = 8,
+        backend: Optional[str] = "auto",
+    ) -> pd.DataFrame:
+        """Recomputes D01 (soil temperature at the corresponding depth below \
+            freezing) and D02 (air temperature below freezing) for every soil \
+            moisture sensor from the co-located temperature sensors of its station, \
+            as listed in "sensor_df", and pickles the counts to \
+            "geophysical_flag_df.pkl". D03 relies on GLDAS and is not recomputed.
+        :param tolerance_minutes: Maximum age of a temperature matched to a soil \
+            moisture observation, by default 60
+        :type tolerance_minutes: Optional[int]
+        :param freezing_point: Temperatures below are freezing, by default 0.0 °C
+        :type freezing_point: Optional[float]
+        :param max_depth_difference: A soil temperature sensor corresponds to \
+            a soil moisture sensor if their layers overlap or their layer centres \
+            are at most this far apart, by default 0.05 m
+        :type max_depth_difference: Optional[float]
+        :param n_cores: The number of workers, each handling whole stations, \
+            by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The number of occurrences of D01 and D02 per soil moisture sensor \
+            ID, in the format of "flag_df". Sensors without a corresponding \
+            temperature sensor count 0
+        :rtype: pd.DataFrame
+        """
+        sensor_df = self._get_sensor_df()
+        sensor_paths = {
+            self.sensor_key(sensor_path): sensor_path
+            for sensor_path in self.get_all_sensors()
+        }
+
+        stations = []
+        for _, sensors in sensor_df.groupby(["network", "station"], sort=False):
+            by_variable = {
+                variable: [
+                    (sensor_id, sensor_paths[path], depth_from, depth_to)
+                    for sensor_id, path, depth_from, depth_to in zip(
+                        group.index, group["path"], group["depthfrom"], group["depthto"]
+                    )
+                ]
+                for variable, group in sensors.groupby("variablename")
+            }
+            if "sm" in by_variable:
+                stations.append(
+                    (by_variable["sm"], by_variable.get("ts"), by_variable.get("ta"))
+                )
+
+        with Executor(backend, n_cores, len(stations)) as executor:
+            results = executor.map(
+                partial(
+                    geophysical_flag_counter,
+                    tolerance_minutes=tolerance_minutes,
+                    freezing_point=freezing_point,
+                    max_depth_difference=max_depth_difference,
+                ),
+                stations,
+            )
+
+        self.geophysical_flag_df = pd.DataFrame.from_dict(
+            dict(counts for station in results for counts in station),
+            orient="index",
+            columns=["D01", "D02"],
+        )
+        count_sensor_files(
+            [
+                sensor[1]
+                for station in stations
+                for sensors in station
+                if sensors is not None
+                for sensor in sensors
+            ]
+        )
+        metrics.count("sensors", len(self.geophysical_flag_df))
+        self.atomic_pickle(
+            self.geophysical_flag_df,
+            os.path.join(
+                self.root, self.database_name, "json_dicts", "geophysical_flag_df.pkl"
+            ),
+        )
+
+        return self.geophysical_flag_df
+
+    @timeit
+    def make_sensor_matrix(
+        self,
+        frequency: Optional[str] = "h",
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+        variable: Optional[str] = "sm",
+        store: Optional[str] = None,
+        chunk_size: Optional[int] = 64,
+        n_cores: Optional[int] = 8,
+        backend: Optional[str] = "auto",
+    ) -> "SensorMatrix":
+        """Resamples all sensors of one variable to a common hourly or daily time \
+            axis and writes a dense float32 matrix of their values (sensors x time) \
+            and a parallel matrix of flag bitmasks as memory-mapped .npy files. \
+            The rows follow the order of the IDs in "sensor_df".
+        :param frequency: The time step, "h" (hourly) or "D" (daily), by default "h"
+        :type frequency: Optional[str]
+        :param start: The first time step, by default the earliest start date \
+            of the sensors
+        :type start: Optional[Any]
+        :param end: The (exclusive) end of the time axis, by default the day after \
+            the latest end date of the sensors
+        :type end: Optional[Any]
+        :param variable: The variable abbreviation of the .stm filenames, \
+            by default "sm"
+        :type variable: Optional[str]
+        :param store: The output directory (the matrices are memory-mapped .npy \
+            files, so NetCDF is not supported), by default \
+            "json_dicts/sensor_matrix_<variable>_<frequency>"
+        :type store: Optional[str]
+        :param chunk_size: The number of sensors resampled per task, by default 64
+        :type chunk_size: Optional[int]
+        :param n_cores: The number of workers used to read the .stm files, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The memory-mapped sensor matrix
+        :rtype: SensorMatrix
+        """
+        steps = {"h": 60, "D": 1440}
+        if frequency not in steps:
+            raise ValueError(
+                f'The frequency "{frequency}" is not supported, use "h" or "D".'
+            )
+        step = steps[frequency]
+
+        if store is None:
+            store = os.path.join(
+                self.root,
+                self.database_name,
+                "json_dicts",
+                f"sensor_matrix_{variable}_{frequency}",
+            )
+        elif store.endswith(".nc"):
+            raise ValueError(
+                f'The sensor matrix is written to a directory of .npy files, \
+                    "{store}" is a NetCDF path.'
+            )
+        # the coordinates are written last and mark the matrix as complete
+        if self.file_exists(os.path.join(store, "dims.json")):
+            print(f"{os.path.basename(store)} exists")
+            return SensorMatrix(store)
+
+        sensor_df = self._get_sensor_df()
+        sensors = sensor_df[(sensor_df["variablename"] == variable).to_numpy(bool)]
+        if sensors.empty:
+            raise ValueError(
+                f'There are no sensors of the variable "{variable}" in \
+                    "{self.database_name}".'
+            )
+        if start is None:
+            start = sensors["startdate"].min()
+        if end is None:
+            end = pd.Timestamp(sensors["enddate"].max()) + pd.Timedelta(days=1)
+        start_minute = pd.Timestamp(start).value // 60_000_000_000 // step * step
+        end_minute = pd.Timestamp(end).value // 60_000_000_000
+        n_steps = max(-(-(end_minute - start_minute) // step), 0)
+
+        sensor_files = {
+            self.sensor_key(sensor_path): sensor_path
+            for sensor_path in self.get_all_sensors()
+        }
+        sensor_paths = [sensor_files[key] for key in sensors["path"]]
+
+        os.makedirs(store, exist_ok=True)
+        shape = (len(sensor_paths), n_steps)
+        for name, dtype in [("values", np.float32), ("flags", np.uint32)]:
+            np.lib.format.open_memmap(
+                os.path.join(store, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape
+            ).flush()
+
+        tasks = [
+            (
+                store,
+                first_row,
+                sensor_paths[first_row : first_row + chunk_size],
+                start_minute,
+                step,
+                n_steps,
+            )
+            for first_row in range(0, len(sensor_paths), chunk_size)
+        ]
+        with Executor(backend, n_cores, len(tasks)) as executor:
+            for _, n_observations in executor.imap_unordered(matrix_row_writer, tasks):
+                metrics.count("observations", n_observations)
+        count_sensor_files(sensor_paths)
+        metrics.count("sensors", len(sensor_paths))
+
+        write_array_store(
+            {
+                "sensor_id": np.array(sensors.index, dtype=str),
+                "time": np.datetime64(int(start_minute), "m")
+                + np.arange(n_steps) * step,
+                "flag": np.array(SoilMoistureFlag.codes()),
+            },
+            store,
+            dims={"values": ("sensor_id", "time"), "flags": ("sensor_id", "time")},
+        )
+
+        return SensorMatrix(store)
+
+
+def write_array_store(arrays: dict, store: str, dims: Optional[dict] = None) -> None:
+    """Writes the arrays of "Flags.grid_flags" either to a NetCDF file, if "store" \
+        ends with ".nc", or to a directory holding one .npy file per array.
+    :param arrays: The arrays, keyed by name
+    :type arrays: dict
+    :param store: The path of the NetCDF file or the directory
+    :type store: str
+    :param dims: The dimension names of every data variable, the other arrays \
+        being coordinates, by default those of the flag grid
+    :type dims: Optional[dict]
+    """
+    if dims is None:
+        dims = {
+            "n_sensors": ("latitude", "longitude"),
+            "flag_count": ("flag", "latitude", "longitude"),
+            "flag_fraction": ("flag", "latitude", "longitude"),
+            "category_count": ("category", "latitude", "longitude"),
+            "category_fraction": ("category", "latitude", "longitude"),
+        }
+    if store.endswith(".nc"):
+        import xarray as xr
+
+        xr.Dataset(
+            {name: (dims[name], arrays[name]) for name in dims},
+            coords={name: arrays[name] for name in arrays if name not in dims},
+        ).to_netcdf(store)
+        return
+
+    os.makedirs(store, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(store, f"{name}.npy"), array)
+    with open(os.path.join(store, "dims.json"), "w") as dims_file:
+        json.dump(dims, dims_file, indent=2)
+
+
+def read_array_store(store: str) -> dict:
+    """Opens a directory written by "write_array_store" without loading the arrays \
+        into memory.
+    :param store: The directory
+    :type store: str
+    :return: The memory-mapped arrays, keyed by name
+    :rtype: dict
+    """
+    return {
+        os.path.splitext(name)[0]: np.load(os.path.join(store, name), mmap_mode="r")
+        for name in sorted(os.listdir(store))
+        if name.endswith(".npy")
+    }
+
+
+def write_flag_dict(flag_dict: dict, path: str) -> None:
+    """Writes the nested "flag_dict" (network, station, sensor, flag) as a binary \
+        file: the network and station names as string offsets and a UTF-8 blob, \
+        the first station of every network, the byte range of every station, and \
+        one pickled block of plain dicts per station.
+    :param flag_dict: The flag counts, as built by "Flags.make_flag_dict"
+    :type flag_dict: dict
+    :param path: The path of the binary file
+    :type path: str
+    :return: None
+    :rtype: None
+    """
+    networks = [network.encode() for network in flag_dict]
+    stations = [
+        station.encode() for stations in flag_dict.values() for station in stations
+    ]
+    blocks = [
+        pickle.dumps(
+            {sensor: dict(counts) for sensor, counts in sensors.items()},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+        for stations_of_network in flag_dict.values()
+        for sensors in stations_of_network.values()
+    ]
+    first_stations = np.zeros(len(networks) + 1, dtype="<u8")
+    first_stations[1:] = np.cumsum([len(stations) for stations in flag_dict.values()])
+    names = networks + stations
+    name_offsets = np.zeros(len(names) + 1, dtype="<u8")
+    name_offsets[1:] = np.cumsum([len(name) for name in names])
+    block_offsets = np.zeros(len(blocks) + 1, dtype="<u8")
+    block_offsets[1:] = np.cumsum([len(block) for block in blocks])
+    name_blob = b"".join(names)
+    name_blob = name_blob.ljust(-(-len(name_blob) // 8) * 8)  # keep the offsets aligned
+
+    with open(f"{path}.tmp", "wb") as bin_file:
+        bin_file.write(FlagDictFile.magic)
+        bin_file.write(
+            np.array(
+                [len(networks), len(stations), len(name_blob)], dtype="<u8"
+            ).tobytes()
+        )
+        bin_file.write(first_stations.tobytes())
+        bin_file.write(name_offsets.tobytes())
+        bin_file.write(block_offsets.tobytes())
+        bin_file.write(name_blob)
+        for block in blocks:
+            bin_file.write(block)
+    os.replace(f"{path}.tmp", path)
+
+
+class FlagDictFile(Mapping):
+    """Reader of the binary files written by "write_flag_dict". Only the names and \
+        offsets are read on opening; a station is read by seeking to its block and \
+        a network by reading the consecutive blocks of its stations. Behaves like \
+        the nested "flag_dict" itself, reading each network on first access."""
+
+    magic = b"FLAGDIC3"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as bin_file:
+            if bin_file.read(len(self.magic)) != self.magic:
+                raise ValueError(f'"{path}" is not a binary flag_dict file.')
+            n_networks, n_stations, name_length = np.fromfile(
+                bin_file, dtype="<u8", count=3
+            ).tolist()
+            first_stations = np.fromfile(
+                bin_file, dtype="<u8", count=n_networks + 1
+            ).tolist()
+            name_offsets = np.fromfile(
+                bin_file, dtype="<u8", count=n_networks + n_stations + 1
+            ).tolist()
+            self.block_offsets = np.fromfile(
+                bin_file, dtype="<u8", count=n_stations + 1
+            ).tolist()
+            name_blob = bin_file.read(int(name_length))
+            self.data_offset = bin_file.tell()
+
+        names = [
+            name_blob[start:stop].decode()
+            for start, stop in zip(name_offsets, name_offsets[1:])
+        ]
+        self.station_names = names[n_networks:]
+        # the range of the stations of every network
+        self.networks = {
+            network: (first, last)
+            for network, first, last in zip(
+                names[:n_networks], first_stations, first_stations[1:]
+            )
+        }
+        self.stations = {
+            (network, self.station_names[i]): i
+            for network, (first, last) in self.networks.items()
+            for i in range(first, last)
+        }
+        self._networks = {}
+
+    def __getitem__(self, network: str) -> dict:
+        if network not in self._networks:
+            self._networks[network] = self.load_network(network)
+        return self._networks[network]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.networks)
+
+    def __len__(self) -> int:
+        return len(self.networks)
+
+    def _read_blocks(self, first: int, last: int) -> bytes:
+        with open(self.path, "rb") as bin_file:
+            bin_file.seek(self.data_offset + self.block_offsets[first])
+            return bin_file.read(self.block_offsets[last] - self.block_offsets[first])
+
+    def _unpickle_stations(self, data: bytes, first: int, last: int) -> dict:
+        data = memoryview(data)
+        offsets = self.block_offsets
+        base = offsets[first]
+        # the many small dicts would otherwise trigger the cyclic garbage collector
+        # over and over, although none of them can be part of a cycle
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return {
+                self.station_names[i]: pickle.loads(
+                    data[offsets[i] - base : offsets[i + 1] - base]
+                )
+                for i in range(first, last)
+            }
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def load_station(self, network: str, station: str) -> dict:
+        """Reads the flag counts of the sensors of one station, and only its block.
+        :param network: The network name
+        :type network: str
+        :param station: The station name
+        :type station: str
+        :return: The flag counts per sensor
+        :rtype: dict
+        """
+        if (network, station) not in self.stations:
+            raise KeyError(
+                f'There is no station "{network}:{station}" in "{self.path}".'
+            )
+        i = self.stations[(network, station)]
+        return pickle.loads(self._read_blocks(i, i + 1))
+
+    def load_network(self, network: str) -> dict:
+        """Reads the flag counts of the sensors of one network.
+        :param network: The network name
+        :type network: str
+        :return: The flag counts per station and sensor
+        :rtype: dict
+        """
+        if network not in self.networks:
+            raise KeyError(f'There is no network "{network}" in "{self.path}".')
+        first, last = self.networks[network]
+        return self._unpickle_stations(self._read_blocks(first, last), first, last)
+
+    def load(self) -> dict:
+        """Reads the whole flag_dict.
+        :return: The flag counts per network, station and sensor
+        :rtype: dict
+        """
+        data = self._read_blocks(0, len(self.station_names))
+        return {
+            network: self._unpickle_stations(
+                memoryview(data)[self.block_offsets[first] : self.block_offsets[last]],
+                first,
+                last,
+            )
+            for network, (first, last) in self.networks.items()
+        }
+
+
+class FlagQuery:
+    """Query engine over the flag fractions of all sensors (the occurrences of a \
+        flag divided by all flag occurrences of the sensor). For every flag, the \
+        sensors are presorted by fraction, so that threshold filters are binary \
+        searches and top-k queries slices of the sorted index."""
+
+    operators = {">": gt, ">=": ge, "<": lt, "<=": le}
+
+    def __init__(
+        self,
+        flag_df: pd.DataFrame,
+        sensor_id_to_path_dict: dict,
+        groups: Optional[pd.DataFrame] = None,
+    ) -> None:
+        counts = flag_df.to_numpy(dtype=np.float64)
+        total = counts.sum(axis=1, keepdims=True)
+        self.fractions = counts / np.where(total > 0, total, 1)
+        self.flags = list(flag_df.columns)
+        self.sensor_ids = flag_df.index.tolist()
+        self.paths = [
+            sensor_id_to_path_dict[sensor_id] for sensor_id in self.sensor_ids
+        ]
+        self.groups = {
+            column: groups[column].to_numpy()
+            for column in (groups.columns if groups is not None else [])
+        }
+
+        # positions of the sensors in ascending order of each flag fraction, ties
+        # in descending order of the sensor ID, so that the reversed order ranks
+        # the worst sensors first and breaks ties by ascending sensor ID
+        by_id = np.argsort(np.array(self.sensor_ids, dtype=str), kind="stable")
+        self.id_rank = np.empty(len(by_id), dtype=np.int64)
+        self.id_rank[by_id] = np.arange(len(by_id))
+        by_id = by_id[::-1]
+        self.order = by_id[np.argsort(self.fractions[by_id], axis=0, kind="stable")]
+        self.sorted_fractions = np.take_along_axis(self.fractions, self.order, axis=0)
+
+    def _column(self, flag: str) -> int:
+        if flag not in self.flags:
+            raise ValueError(f'The flag "{flag}" is not part of "flag_df".')
+        return self.flags.index(flag)
+
+    def _matching(self, flag: str, operator: str, threshold: float) -> np.ndarray:
+        if operator not in self.operators:
+            raise ValueError(
+                f'The operator "{operator}" is none of {", ".join(self.operators)}.'
+            )
+        j = self._column(flag)
+        side = "right" if operator in (">", "<=") else "left"
+        split = np.searchsorted(self.sorted_fractions[:, j], threshold, side=side)
+        return self.order[split:, j] if operator[0] == ">" else self.order[:split, j]
+
+    def _in_groups(self, positions: np.ndarray, groups: dict) -> np.ndarray:
+        for column, values in groups.items():
+            if column not in self.groups:
+                raise ValueError(f'Queries cannot be restricted by "{column}".')
+            values = [values] if isinstance(values, str) else values
+            positions = positions[np.isin(self.groups[column][positions], values)]
+        return positions
+
+    def _result(self, positions: np.ndarray) -> list:
+        return [(self.sensor_ids[i], self.paths[i]) for i in positions]
+
+    def filter(self, conditions: dict, **groups) -> list:
+        """Finds the sensors meeting all conditions, e.g. \
+            filter({"C03": (">", 0.05), "D06": ("<=", 0.01)}, country="AT").
+        :param conditions: The (operator, threshold) per flag, the operator being \
+            one of ">", ">=", "<" or "<="
+        :type conditions: dict
+        :param groups: Restrictions to networks, stations or countries, each \
+            a single value or a list
+        :return: The sensor ID and path of each matching sensor, in database order
+        :rtype: list
+        """
+        candidates = [
+            self._matching(flag, operator, threshold)
+            for flag, (operator, threshold) in conditions.items()
+        ]
+        if not candidates:
+            candidates = [np.arange(len(self.sensor_ids))]
+
+        # start from the most selective condition and check the others directly
+        smallest = int(np.argmin([len(positions) for positions in candidates]))
+        positions = np.sort(candidates[smallest])
+        for flag, (operator, threshold) in conditions.items():
+            column = self.fractions[positions, self._column(flag)]
+            positions = positions[self.operators[operator](column, threshold)]
+
+        return self._result(self._in_groups(positions, groups))
+
+    def top_k(self, flag: str, k: Optional[int] = 10, **groups) -> list:
+        """Finds the sensors with the highest fraction of a flag, e.g. \
+            top_k("D06", 50, country=["AT", "DE"]).
+        :param flag: The flag code
+        :type flag: str
+        :param k: The number of sensors, by default 10
+        :type k: Optional[int]
+        :param groups: Restrictions to networks, stations or countries, each \
+            a single value or a list
+        :return: The sensor ID and path of the k worst sensors, the worst first and \
+            ties in ascending order of the sensor ID
+        :rtype: list
+        """
+        j = self._column(flag)
+        if not groups:
+            return self._result(self.order[::-1, j][:k])
+
+        positions = self._in_groups(np.arange(len(self.sensor_ids)), groups)
+        fractions = self.fractions[positions, j]
+        if 0 < k < len(positions):
+            # all sensors tied with the k-th are kept, the tie-break picks among them
+            kth = -np.partition(-fractions, k - 1)[k - 1]
+            keep = fractions >= kth
+            positions, fractions = positions[keep], fractions[keep]
+        ranking = np.lexsort((self.id_rank[positions], -fractions))
+        return self._result(positions[ranking][:k])
+
+
+class QualityTimelines:
+    """Run-length encoded flag timelines of all sensors of a database. \
+        Answers interval, duration and longest-run queries by binary search over \
+        the segments, without touching the .stm files."""
+
+    def __init__(self, timelines_file: str) -> None:
+        with np.load(timelines_file) as npz:
+            self.sensor_ids = npz["sensor_ids"].tolist()
+            self.flag_codes = npz["flag_codes"].tolist()
+            self.offsets = npz["offsets"]
+            self.starts = npz["starts"]
+            self.ends = npz["ends"]
+            self.masks = npz["masks"]
+
+        self._sensor_index = {
+            sensor_id: i for i, sensor_id in enumerate(self.sensor_ids)
+        }
+
+    def flag_mask(self, flags: list) -> int:
+        """Converts flag codes into a bitmask.
+        :param flags: The flag codes, e.g. ["D09", "D10"]
+        :type flags: list
+        :return: The bitmask selecting the given flags
+        :rtype: int
+        """
+        mask = 0
+        for flag in flags:
+            if flag not in self.flag_codes:
+                raise ValueError(f'The flag "{flag}" is not part of the timelines.')
+            mask |= 1 << self.flag_codes.index(flag)
+
+        return mask
+
+    def _to_minutes(self, timestamp: Any) -> int:
+        return int(pd.Timestamp(timestamp).value // 60_000_000_000)
+
+    def _to_datetime(self, minutes: int) -> datetime.datetime:
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(minutes=int(minutes))
+
+    def _flagged_runs(
+        self,
+        sensor_id: str,
+        flags: list,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if sensor_id not in self._sensor_index:
+            raise KeyError(f'There is no timeline for the sensor "{sensor_id}".')
+
+        i = self._sensor_index[sensor_id]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        starts, ends, masks = self.starts[lo:hi], self.ends[lo:hi], self.masks[lo:hi]
+
+        t0 = self._to_minutes(start) if start is not None else None
+        t1 = self._to_minutes(end) if end is not None else None
+        first = np.searchsorted(ends, t0, side="right") if t0 is not None else 0
+        last = (
+            np.searchsorted(starts, t1, side="left") if t1 is not None else len(starts)
+        )
+        starts, ends, masks = starts[first:last], ends[first:last], masks[first:last]
+
+        flagged = np.flatnonzero(masks & self.flag_mask(flags))
+        starts, ends = starts[flagged].astype(np.int64), ends[flagged].astype(np.int64)
+        if len(starts) == 0:
+            return starts, ends
+
+        # adjacent flagged segments (e.g. "D09" followed by "D09,D10") form one run
+        new_run = np.concatenate(([True], starts[1:] != ends[:-1]))
+        run_first = np.flatnonzero(new_run)
+        run_last = np.concatenate((run_first[1:] - 1, [len(starts) - 1]))
+        starts, ends = starts[run_first], ends[run_last]
+
+        if t0 is not None:
+            starts = np.maximum(starts, t0)
+        if t1 is not None:
+            ends = np.minimum(ends, t1)
+        # an empty period clips its overlapping run to nothing
+        non_empty = ends > starts
+
+        return starts[non_empty], ends[non_empty]
+
+    def flagged_intervals(
+        self,
+        sensor_id: str,
+        flags: list,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+    ) -> list[tuple[datetime.datetime, datetime.datetime]]:
+        """Returns the periods during which the sensor carried any of the given flags.
+        :param sensor_id: The sensor ID, as in "sensor_df"
+        :type sensor_id: str
+        :param flags: The flag codes, e.g. ["D09", "D10"]
+        :type flags: list
+        :param start: Beginning of the queried period, by default the first observation
+        :type start: Optional[Any]
+        :param end: End of the queried period, by default the last observation
+        :type end: Optional[Any]
+        :return: The (start, end) of every flagged period
+        :rtype: list[tuple[datetime.datetime, datetime.datetime]]
+        """
+        starts, ends = self._flagged_runs(sensor_id, flags, start, end)
+        return [
+            (self._to_datetime(s), self._to_datetime(e)) for s, e in zip(starts, ends)
+        ]
+
+    def flagged_duration(
+        self,
+        sensor_id: str,
+        flags: list,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+    ) -> datetime.timedelta:
+        """Returns the total time the sensor carried any of the given flags.
+        :param sensor_id: The sensor ID, as in "sensor_df"
+        :type sensor_id: str
+        :param flags: The flag codes, e.g. ["D09", "D10"]
+        :type flags: list
+        :param start: Beginning of the queried period, by default the first observation
+        :type start: Optional[Any]
+        :param end: End of the queried period, by default the last observation
+        :type end: Optional[Any]
+        :return: The total flagged duration
+        :rtype: datetime.timedelta
+        """
+        starts, ends = self._flagged_runs(sensor_id, flags, start, end)
+        return datetime.timedelta(minutes=int(np.sum(ends - starts)))
+
+    def longest_run(
+        self,
+        sensor_id: str,
+        flags: list,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+    ) -> Optional[tuple[datetime.datetime, datetime.datetime, datetime.timedelta]]:
+        """Returns the longest uninterrupted period with any of the given flags.
+        :param sensor_id: The sensor ID, as in "sensor_df"
+        :type sensor_id: str
+        :param flags: The flag codes, e.g. ["D09", "D10"]
+        :type flags: list
+        :param start: Beginning of the queried period, by default the first observation
+        :type start: Optional[Any]
+        :param end: End of the queried period, by default the last observation
+        :type end: Optional[Any]
+        :return: Start, end and duration of the longest run, None if never flagged
+        :rtype: Optional[tuple[datetime.datetime, datetime.datetime, datetime.timedelta]]
+        """
+        starts, ends = self._flagged_runs(sensor_id, flags, start, end)
+        if len(starts) == 0:
+            return None
+
+        i = int(np.argmax(ends - starts))
+        return (
+            self._to_datetime(starts[i]),
+            self._to_datetime(ends[i]),
+            datetime.timedelta(minutes=int(ends[i] - starts[i])),
+        )
+
+
+class SensorMatrix:
+    """Dense, memory-mapped matrices of the resampled values and flag bitmasks \
+        of all sensors of one variable on a common time axis, as written by \
+        "Flags.make_sensor_matrix". Slices are read from disk on access only."""
+
+    def __init__(self, store: str) -> None:
+        arrays = read_array_store(store)
+        self.values = arrays["values"]
+        self.flags = arrays["flags"]
+        self.sensor_ids = arrays["sensor_id"].tolist()
+        self.time = arrays["time"]
+        self.flag_codes = arrays["flag"].tolist()
+
+        self._sensor_index = {
+            sensor_id: i for i, sensor_id in enumerate(self.sensor_ids)
+        }
+
+    def flag_mask(self, flags: list) -> int:
+        """Converts flag codes into a bitmask.
+        :param flags: The flag codes, e.g. ["D09", "D10"]
+        :type flags: list
+        :return: The bitmask selecting the given flags
+        :rtype: int
+        """
+        mask = 0
+        for flag in flags:
+            if flag not in self.flag_codes:
+                raise ValueError(f'The flag "{flag}" is not part of the matrix.')
+            mask |= 1 << self.flag_codes.index(flag)
+
+        return mask
+
+    def _rows(self, sensor_ids: Optional[list]) -> Any:
+        if sensor_ids is None:
+            return slice(None)
+
+        return np.array([self._sensor_index[sensor_id] for sensor_id in sensor_ids])
+
+    def _columns(self, start: Any, end: Any) -> slice:
+        def position(timestamp: Any) -> Optional[int]:
+            if timestamp is None:
+                return None
+            return int(
+                np.searchsorted(self.time, pd.Timestamp(timestamp).to_datetime64())
+            )
+
+        return slice(position(start), position(end))
+
+    def select(
+        self,
+        sensor_ids: Optional[list] = None,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+        exclude_flags: Optional[list] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Loads a block of the matrices.
+        :param sensor_ids: The IDs of "sensor_df" to load, in the order of the \
+            returned rows, by default all sensors
+        :type sensor_ids: Optional[list]
+        :param start: The first time step, by default the start of the time axis
+        :type start: Optional[Any]
+        :param end: The (exclusive) end, by default the end of the time axis
+        :type end: Optional[Any]
+        :param exclude_flags: Flag codes whose time steps are set to NaN \
+            in the values, by default none
+        :type exclude_flags: Optional[list]
+        :return: The values and the flag bitmasks, shaped (sensor, time)
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        rows, columns = self._rows(sensor_ids), self._columns(start, end)
+        values = np.array(self.values[rows, columns])
+        flags = np.array(self.flags[rows, columns])
+        if exclude_flags:
+            values[(flags & self.flag_mask(exclude_flags)) != 0] = np.nan
+
+        return values, flags
+
+    def to_pandas(
+        self,
+        sensor_ids: Optional[list] = None,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None,
+        exclude_flags: Optional[list] = None,
+    ) -> pd.DataFrame:
+        """Loads a block of the values as a dataframe with one column per sensor, \
+            see "select".
+        :return: The values, indexed by time
+        :rtype: pd.DataFrame
+        """
+        values, _ = self.select(sensor_ids, start, end, exclude_flags)
+        return pd.DataFrame(
+            values.T,
+            index=pd.DatetimeIndex(self.time[self._columns(start, end)], name="time"),
+            columns=self.sensor_ids if sensor_ids is None else list(sensor_ids),
+        )
+
+
+class StationIndex:
+    """KD-tree over the stations of a database, built on their positions as unit \
+        vectors so that chord lengths translate exactly into great-circle distances. \
+        Answers nearest-station, radius and bounding-box queries with the IDs of \
+        "sensor_df"."""
+
+    earth_radius_km = 6371.0088
+
+    def __init__(self, index_file: str) -> None:
+        with np.load(index_file) as npz:
+            self.stations = npz["stations"].tolist()
+            self.latitudes = npz["latitudes"]
+            self.longitudes = npz["longitudes"]
+            self.offsets = npz["offsets"]
+            self.sensor_ids = npz["sensor_ids"].tolist()
+
+        self.tree = scipy_spatial.cKDTree(
+            self._to_unit_vectors(self.latitudes, self.longitudes)
+        )
+        self._latitude_order = np.argsort(self.latitudes, kind="stable")
+        self._sorted_latitudes = self.latitudes[self._latitude_order]
+
+    def _to_unit_vectors(self, latitudes: Any, longitudes: Any) -> np.ndarray:
+        lat, lon = np.radians(latitudes), np.radians(longitudes)
+        return np.column_stack(
+            [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+        )
+
+    def _sensors_of(self, station_indices: Any) -> list:
+        return [
+            sensor_id
+            for i in station_indices
+            for sensor_id in self.sensor_ids[self.offsets[i] : self.offsets[i + 1]]
+        ]
+
+    def distances_km(self, latitude: float, longitude: float) -> np.ndarray:
+        """Great-circle distances from a point to all stations.
+        :param latitude: Latitude of the point in degrees
+        :type latitude: float
+        :param longitude: Longitude of the point in degrees
+        :type longitude: float
+        :return: The distance to each station in km, in the order of "stations"
+        :rtype: np.ndarray
+        """
+        point = self._to_unit_vectors(latitude, longitude)[0]
+        chords = np.linalg.norm(self.tree.data - point, axis=1)
+        return 2 * self.earth_radius_km * np.arcsin(np.clip(chords / 2, 0, 1))
+
+    def nearest(self, latitude: float, longitude: float, k: Optional[int] = 1) -> list:
+        """Finds the k stations closest to a point.
+        :param latitude: Latitude of the point in degrees
+        :type latitude: float
+        :param longitude: Longitude of the point in degrees
+        :type longitude: float
+        :param k: The number of stations, by default 1
+        :type k: Optional[int]
+        :return: The sensor IDs of these stations, closest station first
+        :rtype: list
+        """
+        k = min(k, len(self.stations))
+        _, station_indices = self.tree.query(
+            self._to_unit_vectors(latitude, longitude)[0], k=k
+        )
+        return self._sensors_of(np.atleast_1d(station_indices))
+
+    def within_radius(
+        self, latitude: float, longitude: float, radius_km: float
+    ) -> list:
+        """Finds all stations within a great-circle distance of a point.
+        :param latitude: Latitude of the point in degrees
+        :type latitude: float
+        :param longitude: Longitude of the point in degrees
+        :type longitude: float
+        :param radius_km: The search radius in km
+        :type radius_km: float
+        :return: The sensor IDs of these stations, closest station first
+        :rtype: list
+        """
+        angle = min(radius_km / self.earth_radius_km, np.pi)
+        point = self._to_unit_vectors(latitude, longitude)[0]
+        station_indices = self.tree.query_ball_point(point, 2 * np.sin(angle / 2))
+        distances = np.linalg.norm(self.tree.data[station_indices] - point, axis=1)
+        return self._sensors_of(np.asarray(station_indices)[np.argsort(distances)])
+
+    def within_bbox(
+        self,
+        min_latitude: float,
+        max_latitude: float,
+        min_longitude: float,
+        max_longitude: float,
+    ) -> list:
+        """Finds all stations inside a latitude/longitude box. A box with \
+            min_longitude > max_longitude crosses the antimeridian.
+        :param min_latitude: Southern edge in degrees
+        :type min_latitude: float
+        :param max_latitude: Northern edge in degrees
+        :type max_latitude: float
+        :param min_longitude: Western edge in degrees
+        :type min_longitude: float
+        :param max_longitude: Eastern edge in degrees
+        :type max_longitude: float
+        :return: The sensor IDs of these stations, in database order
+        :rtype: list
+        """
+        lo = np.searchsorted(self._sorted_latitudes, min_latitude, side="left")
+        hi = np.searchsorted(self._sorted_latitudes, max_latitude, side="right")
+        station_indices = self._latitude_order[lo:hi]
+
+        longitudes = self.longitudes[station_indices]
+        if min_longitude <= max_longitude:
+            inside = (longitudes >= min_longitude) & (longitudes <= max_longitude)
+        else:
+            inside = (longitudes >= min_longitude) | (longitudes <= max_longitude)
+
+        return self._sensors_of(np.sort(station_indices[inside]))
+
+
+class SnapshotDiff(Tools):
+    """Compares two versions of the ISMN database (directories or zip archives) \
+        sensor by sensor"""
+
+    identity = [
+        "network",
+        "station",
+        "variablename",
+        "depthfrom",
+        "depthto",
+        "sensorname",
+        "startdate",
+    ]
+
+    def __init__(self, old_database: str, new_database: str) -> None:
+        super().__init__()
+        self.old = self.open_snapshot(old_database)
+        self.new = self.open_snapshot(new_database)
+        self.flags = [kind for kind in SoilMoistureFlag.codes() if kind != "M"]
+
+    def open_snapshot(self, database_path: str) -> Tools:
+        """Builds the sensor catalog of one database version with make_sensor_ids.
+        :param database_path: A string containing the path (absolute or relative) \
+              to the database
+        :type database_path: str
+        :return: The catalogued database version
+        :rtype: Tools
+        """
+        if not self.check_database(database_path):
+            raise ValueError(
+                f'The specified database "{database_path}" does not exist \
+                    in the current working directory: "{os.getcwd()}".'
+            )
+
+        snapshot = Tools()
+        snapshot.database_name = os.path.basename(os.path.normpath(database_path))
+        if zipfile.is_zipfile(database_path):
+            snapshot.archive = os.path.abspath(database_path)
+            snapshot.database_name = os.path.splitext(snapshot.database_name)[0]
+
+        os.makedirs(os.path.join(snapshot.database_name, "json_dicts"), exist_ok=True)
+        snapshot.make_sensor_ids()
+        snapshot.sensor_paths = {
+            snapshot.sensor_key(sensor_path): sensor_path
+            for sensor_path in snapshot.get_all_sensors()
+        }
+
+        return snapshot
+
+    @timeit
+    def diff(
+        self, n_cores: Optional[int] = 8, backend: Optional[str] = "auto"
+    ) -> pd.DataFrame:
+        """Classifies every sensor as "added", "removed", "unchanged", "extended" \
+            (longer record with an unchanged beginning) or "modified" and computes \
+            the change of its flag counts. Only the files of sensors whose \
+            fingerprints differ are read.
+        :param n_cores: The number of workers, by default 8
+        :type n_cores: Optional[int]
+        :param backend: One of "serial", "threads", "processes" or "auto", \
+            by default "auto", see Executor
+        :type backend: Optional[str]
+        :return: The identity, old and new sensor ID, status and flag count \
+            changes (new minus old) of every sensor
+        :rtype: pd.DataFrame
+        """
+        diff_df = pd.merge(
+            self.old.sensor_df.rename_axis("sensor_id").reset_index(),
+            self.new.sensor_df.rename_axis("sensor_id").reset_index(),
+            on=self.identity,
+            how="outer",
+            suffixes=("_old", "_new"),
+            indicator=True,
+        )
+        diff_df["status"] = (
+            diff_df["_merge"]
+            .astype(str)
+            .map({"left_only": "removed", "right_only": "added", "both": "unchanged"})
+        )
+
+        both = diff_df.index[diff_df["_merge"] == "both"]
+        old_paths = [
+            self.old.sensor_paths[key] for key in diff_df.loc[both, "path_old"]
+        ]
+        new_paths = [
+            self.new.sensor_paths[key] for key in diff_df.loc[both, "path_new"]
+        ]
+        # CRCs are only comparable when both versions are zip archives
+        fingerprint = partial(
+            sensor_fingerprint,
+            use_crc=self.old.archive is not None and self.new.archive is not None,
+        )
+        with Executor(backend, n_cores, 2 * len(both)) as executor:
+            old_fingerprints = executor.map(fingerprint, old_paths)
+            new_fingerprints = executor.map(fingerprint, new_paths)
+
+            for i, old_path, new_path, old_print, new_print in zip(
+                both, old_paths, new_paths, old_fingerprints, new_fingerprints
+            ):
+                if old_print == new_print and (
+                    os.path.basename(old_path) == os.path.basename(new_path)
+                ):
+                    continue
+                extended = (
+                    new_print[0] > old_print[0]
+                    and new_print[1] == old_print[1]
+                    and diff_df.at[i, "enddate_new"] > diff_df.at[i, "enddate_old"]
+                )
+                diff_df.at[i, "status"] = "extended" if extended else "modified"
+
+            changed = diff_df["status"] != "unchanged"
+            to_read = [
+                self.old.sensor_paths[key]
+                for key in diff_df.loc[changed, "path_old"].dropna()
+            ] + [
+                self.new.sensor_paths[key]
+                for key in diff_df.loc[changed, "path_new"].dropna()
+            ]
+            counts = dict(executor.map(flag_counter, to_read))
+
+        bits = [SoilMoistureFlag(flag).bit for flag in self.flags]
+        zeros = np.zeros(len(SoilMoistureFlag.codes()), dtype=np.int64)
+
+        def flag_counts(snapshot: Tools, keys: pd.Series) -> np.ndarray:
+            return np.array(
+                [
+                    (
+                        counts[snapshot.sensor_paths[key]][bits]
+                        if isinstance(key, str)
+                        else zeros[bits]
+                    )
+                    for key in keys
+                ],
+                dtype=np.int64,
+            ).reshape(-1, len(bits))
+
+        deltas = flag_counts(self.new, diff_df.loc[changed, "path_new"]) - flag_counts(
+            self.old, diff_df.loc[changed, "path_old"]
+        )
+        diff_df[self.flags] = 0
+        diff_df.loc[changed, self.flags] = deltas
+
+        self.diff_df = diff_df.drop(columns="_merge")
+        return self.diff_df
+
+    def report(self) -> None:
+        """Prints the number of sensors per status and the total change of every flag."""
+        if not hasattr(self, "diff_df"):
+            self.diff()
+
+        print(
+            f"\n{self.old.database_name} -> {self.new.database_name}\n"
+            f"{self.diff_df['status'].value_counts().to_string()}\n\n"
+            f"Change of flag counts:\n{self.diff_df[self.flags].sum().to_string()}\n"
+        )
+
+
+class QueryService:
+    """Answers per-sensor, per-network and per-country flag queries, catalog \
+        lookups, filters and top-k queries from the artifacts in "json_dicts", \
+        which are loaded once and kept in memory. Runs as a local HTTP server \
+        handling requests in parallel threads, without constructing "Flags" \
+        and the ISMN interface behind it.
+
+    GET endpoints, responding with JSON; the tables also as Arrow IPC files \
+    with "?format=arrow":
+        /status
+        /sensors?network=&station=&country=   (table)
+        /sensors/<sensor_id>
+        /networks                             (table)
+        /networks/<network>
+        /countries                            (table)
+        /countries/<country>
+        /filter?C03=>0.05&D06=<=0.01&network= (table)
+        /top?flag=D06&k=10&country=           (table)
+    POST /reload loads the artifacts again, e.g. after "flag_df.pkl" was rebuilt."""
+
+    groups = ("network", "station", "country")
+
+    def __init__(self, database_path: str) -> None:
+        self.database_path = database_path
+        self.database_name = os.path.basename(os.path.normpath(database_path))
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    def _json_dicts_file(self, name: str) -> str:
+        return os.path.join(self.database_path, "json_dicts", name)
+
+    def reload(self) -> dict:
+        """Loads "flag_df.pkl", "sensor_df.pkl" and, if present, "locations.json" \
+            and "countries.json", and precomputes the network and country sums. \
+            The new state replaces the old one at once, so that requests being \
+            served meanwhile see either of them completely.
+        :return: The status after reloading, see "status"
+        :rtype: dict
+        """
+        with self._reload_lock:
+            files = {
+                name: self._json_dicts_file(name)
+                for name in [
+                    "flag_df.pkl",
+                    "sensor_df.pkl",
+                    "locations.json",
+                    "countries.json",
+                ]
+            }
+            for name in ["flag_df.pkl", "sensor_df.pkl"]:
+                if not os.path.isfile(files[name]):
+                    raise ValueError(
+                        f'"{files[name]}" does not exist, run Flags.get_flag_df first.'
+                    )
+
+            def read_optional_json(name: str) -> dict:
+                if not os.path.isfile(files[name]):
+                    return {}
+                with open(files[name]) as json_file:
+                    return json.load(json_file)
+
+            flag_df = pd.read_pickle(files["flag_df.pkl"])
+            sensor_df = pd.read_pickle(files["sensor_df.pkl"])
+            locations_dict = read_optional_json("locations.json")
+            countries_dict = read_optional_json("countries.json")
+
+            catalog = (
+                sensor_df.loc[flag_df.index].astype(object).rename_axis("sensor_id")
+            )
+            catalog["country"] = (
+                (catalog["network"] + ":" + catalog["station"])
+                .map(locations_dict)
+                .fillna("Unknown")
+            )
+            counts = pd.DataFrame(
+                flag_df.to_numpy(dtype=np.int64),
+                index=flag_df.index,
+                columns=list(flag_df.columns),
+            )
+
+            def sums(level: str) -> pd.DataFrame:
+                grouped = counts.groupby(catalog[level].to_numpy())
+                return grouped.sum().assign(n_sensors=grouped.size())
+
+            self._state = {
+                "catalog": catalog,
+                "counts": counts,
+                "positions": {
+                    sensor_id: i for i, sensor_id in enumerate(flag_df.index)
+                },
+                "network_sums": sums("network"),
+                "country_sums": sums("country"),
+                "countries_dict": countries_dict,
+                "query": FlagQuery(
+                    counts,
+                    catalog["path"].to_dict(),
+                    catalog[list(self.groups)],
+                ),
+                "loaded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "modified": {
+                    name: datetime.datetime.fromtimestamp(
+                        os.path.getmtime(path)
+                    ).isoformat(timespec="seconds")
+                    for name, path in files.items()
+                    if os.path.isfile(path)
+                },
+            }
+
+        print(f"Loaded the flags of {len(flag_df)} sensors of {self.database_name}")
+        return self.status()
+
+    def status(self) -> dict:
+        state = self._state
+        return {
+            "database": self.database_name,
+            "sensors": len(state["counts"]),
+            "networks": len(state["network_sums"]),
+            "countries": len(state["country_sums"]),
+            "flags": list(state["counts"].columns),
+            "loaded_at": state["loaded_at"],
+            "modified": state["modified"],
+        }
+
+    def _flag_summary(self, counts: pd.Series) -> dict:
+        total = int(counts.sum())
+        return {
+            "total": total,
+            "counts": {flag: int(count) for flag, count in counts.items()},
+            "fractions": {
+                flag: (int(count) / total if total else 0.0)
+                for flag, count in counts.items()
+            },
+        }
+
+    def sensor(self, sensor_id: str) -> dict:
+        """The catalog entry and the flags of one sensor.
+        :param sensor_id: The ID of "sensor_df"
+        :type sensor_id: str
+        :return: The catalog fields, the flag counts and the flag fractions
+        :rtype: dict
+        """
+        state = self._state
+        if sensor_id not in state["positions"]:
+            raise KeyError(f'There is no sensor "{sensor_id}".')
+
+        return {
+            "sensor_id": sensor_id,
+            **state["catalog"].loc[sensor_id].to_dict(),
+            **self._flag_summary(state["counts"].iloc[state["positions"][sensor_id]]),
+        }
+
+    def network(self, network: str) -> dict:
+        """The summed flags of all sensors of one network.
+        :param network: The network name
+        :type network: str
+        :return: The number of sensors, the flag counts and the flag fractions
+        :rtype: dict
+        """
+        network_sums = self._state["network_sums"]
+        if network not in network_sums.index:
+            raise KeyError(f'There is no network "{network}".')
+
+        row = network_sums.loc[network]
+        return {
+            "network": network,
+            "n_sensors": int(row["n_sensors"]),
+            **self._flag_summary(row.drop("n_sensors")),
+        }
+
+    def country(self, country: str) -> dict:
+        """The summed flags of all sensors located in one country, \
+            see Geography.sort_stations_to_countries.
+        :param country: The country name, "Unknown" for unlocated stations
+        :type country: str
+        :return: The networks, the number of sensors, the flag counts and \
+            the flag fractions
+        :rtype: dict
+        """
+        state = self._state
+        if country not in state["country_sums"].index:
+            raise KeyError(f'There is no country "{country}".')
+
+        row = state["country_sums"].loc[country]
+        return {
+            "country": country,
+            "networks": state["countries_dict"].get(country, []),
+            "n_sensors": int(row["n_sensors"]),
+            **self._flag_summary(row.drop("n_sensors")),
+        }
+
+    def sensors(self, **groups) -> pd.DataFrame:
+        """The catalog, restricted to networks, stations or countries, each given \
+            as a single value or a list.
+        :return: The catalog entries, indexed by sensor ID
+        :rtype: pd.DataFrame
+        """
+        catalog = self._state["catalog"]
+        keep = np.ones(len(catalog), dtype=bool)
+        for column, values in groups.items():
+            if column not in self.groups:
+                raise ValueError(f'The catalog cannot be restricted by "{column}".')
+            values = [values] if isinstance(values, str) else values
+            keep &= catalog[column].isin(values).to_numpy()
+
+        return catalog[keep]
+
+    def _query_result(self, result: list) -> pd.DataFrame:
+        state = self._state
+        sensor_ids = [sensor_id for sensor_id, _ in result]
+        counts = state["counts"].loc[sensor_ids]
+        fractions = counts.div(
+            counts.sum(axis=1).where(lambda total: total > 0), axis=0
+        )
+        return (
+            state["catalog"]
+            .loc[sensor_ids]
+            .join(fractions.fillna(0.0).add_prefix("fraction_"))
+        )
+
+    def filter(self, conditions: dict, **groups) -> pd.DataFrame:
+        """See FlagQuery.filter.
+        :return: The catalog entries and flag fractions of the matching sensors
+        :rtype: pd.DataFrame
+        """
+        return self._query_result(self._state["query"].filter(conditions, **groups))
+
+    def top_k(self, flag: str, k: Optional[int] = 10, **groups) -> pd.DataFrame:
+        """See FlagQuery.top_k.
+        :return: The catalog entries and flag fractions of the k worst sensors
+        :rtype: pd.DataFrame
+        """
+        if k < 0:
+            raise ValueError(f'"k" must be a non-negative integer, not {k}.')
+        return self._query_result(self._state["query"].top_k(flag, k, **groups))
+
+    def _table(self, name: str) -> pd.DataFrame:
+        sums = self._state[f"{name}_sums"]
+        total = sums.drop(columns="n_sensors").sum(axis=1)
+        return sums.assign(total=total).rename_axis(name)
+
+    def handle(self, method: str, url: str) -> tuple[int, str, bytes]:
+        """Answers one request, see the class docstring for the endpoints. \
+            Unexpected errors are answered with status 500.
+        :param method: "GET" or "POST"
+        :type method: str
+        :param url: The path and query string of the request
+        :type url: str
+        :return: The HTTP status, the content type and the body
+        :rtype: tuple[int, str, bytes]
+        """
+        try:
+            return self._handle(method, url)
+        except Exception as error:
+            return self._error(500, f"{type(error).__name__}: {error}")
+
+    def _handle(self, method: str, url: str) -> tuple[int, str, bytes]:
+        from urllib.parse import parse_qs, urlsplit, unquote
+
+        split_url = urlsplit(url)
+        parts = [unquote(part) for part in split_url.path.split("/") if part]
+        query = {
+            key: values if len(values) > 1 else values[0]
+            for key, values in parse_qs(split_url.query).items()
+        }
+        output_format = query.pop("format", "json")
+        groups = {key: query.pop(key) for key in self.groups if key in query}
+
+        try:
+            if method == "POST" and parts == ["reload"]:
+                response = self.reload()
+            elif method != "GET":
+                return self._error(405, f"{method} is not supported for {url}")
+            elif parts == ["status"]:
+                response = self.status()
+            elif parts[:1] == ["sensors"] and len(parts) == 2:
+                response = self.sensor(parts[1])
+            elif parts == ["sensors"]:
+                response = self.sensors(**groups)
+            elif parts[:1] == ["networks"] and len(parts) == 2:
+                response = self.network(parts[1])
+            elif parts == ["networks"]:
+                response = self._table("network")
+            elif parts[:1] == ["countries"] and len(parts) == 2:
+                response = self.country(parts[1])
+            elif parts == ["countries"]:
+                response = self._table("country")
+            elif parts == ["filter"]:
+                conditions = {}
+                for flag, condition in query.items():
+                    operator = condition[:2] if condition[1:2] == "=" else condition[:1]
+                    conditions[flag] = (operator, float(condition[len(operator) :]))
+                response = self.filter(conditions, **groups)
+            elif parts == ["top"]:
+                if "flag" not in query:
+                    raise ValueError('The query parameter "flag" is missing.')
+                k = query.get("k", "10")
+                if not isinstance(k, str) or not k.isdigit():
+                    raise ValueError(f'"k" must be a non-negative integer, not "{k}".')
+                response = self.top_k(query["flag"], int(k), **groups)
+            else:
+                return self._error(404, f"There is no endpoint {split_url.path}")
+        except KeyError as error:
+            return self._error(404, str(error.args[0]))
+        except (ValueError, TypeError) as error:
+            return self._error(400, str(error))
+
+        if isinstance(response, pd.DataFrame):
+            if output_format == "arrow":
+                buffer = io.BytesIO()
+                pl.from_pandas(response.reset_index()).write_ipc(buffer)
+                return 200, "application/vnd.apache.arrow.file", buffer.getvalue()
+            response = json.loads(response.reset_index().to_json(orient="records"))
+
+        return 200, "application/json", json.dumps(response).encode()
+
+    def _error(self, status: int, message: str) -> tuple[int, str, bytes]:
+        return status, "application/json", json.dumps({"error": message}).encode()
+
+    def make_server(
+        self, host: Optional[str] = "127.0.0.1", port: Optional[int] = 8765
+    ) -> Any:
+        """Creates the HTTP server, which handles every request in its own thread.
+        :param host: The address to listen on, by default only the local machine
+        :type host: Optional[str]
+        :param port: The port, by default 8765, 0 for any free port
+        :type port: Optional[int]
+        :return: The server, not yet serving
+        :rtype: http.server.ThreadingHTTPServer
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        service = self
+
+        class QueryRequestHandler(BaseHTTPRequestHandler):
+            def respond(self) -> None:
+                status, content_type, body = service.handle(self.command, self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = respond
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+        server.daemon_threads = True
+        return server
+
+    def serve(
+        self, host: Optional[str] = "127.0.0.1", port: Optional[int] = 8765
+    ) -> None:
+        """Serves queries until interrupted, see "make_server".
+        :param host: The address to listen on, by default only the local machine
+        :type host: Optional[str]
+        :param port: The port, by default 8765
+        :type port: Optional[int]
+        """
+        with self.make_server(host, port) as server:
+            print(f"Serving {self.database_name} on http://{host}:{server.server_port}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                print("Stopped serving")
+
 
 class GroupDynamicVariable(Flags):
     def __init__(self):
@@ -1033,6 +4630,254 @@ class D10(SpectrumBased):
             soil moisture spectrum"
 
 
+class SpectrumQC:
+    """Recomputes the spectrum based flags D06 to D10 of a soil moisture series with \
+        vectorized derivative and run-length operations, following the checks of \
+        the ISMN quality control (Dorigo et al., 2013). All thresholds can be tuned.
+    :param spike_change: Minimum relative change towards a spike, by default 0.15
+    :type spike_change: Optional[float]
+    :param spike_symmetry: Maximum relative difference between the rise and the \
+        fall of a spike, by default 0.2
+    :type spike_symmetry: Optional[float]
+    :param jump_change: Minimum relative change of a jump, by default 0.15
+    :type jump_change: Optional[float]
+    :param jump_persistence: Number of following observations (at least 1) that \
+        have to stay beyond half of a jump, by default 3
+    :type jump_persistence: Optional[int]
+    :param constant_tolerance: Maximum change between observations of a constant \
+        period in m^3/m^3, by default 1e-4
+    :type constant_tolerance: Optional[float]
+    :param constant_hours: Minimum duration of a low constant period or plateau, \
+        by default 12
+    :type constant_hours: Optional[float]
+    :param low_quantile: Constant periods at or below this quantile of the series \
+        are low constant values, by default 0.05
+    :type low_quantile: Optional[float]
+    :param plateau_quantile: Constant periods at or above this quantile of the \
+        series are saturated plateaus, by default 0.95
+    :type plateau_quantile: Optional[float]
+    :param max_gap_minutes: Observations further apart are not compared, \
+        by default 60
+    :type max_gap_minutes: Optional[int]
+    """
+
+    flags = ["D06", "D07", "D08", "D09", "D10"]
+
+    def __init__(
+        self,
+        spike_change: Optional[float] = 0.15,
+        spike_symmetry: Optional[float] = 0.2,
+        jump_change: Optional[float] = 0.15,
+        jump_persistence: Optional[int] = 3,
+        constant_tolerance: Optional[float] = 1e-4,
+        constant_hours: Optional[float] = 12,
+        low_quantile: Optional[float] = 0.05,
+        plateau_quantile: Optional[float] = 0.95,
+        max_gap_minutes: Optional[int] = 60,
+    ) -> None:
+        self.spike_change = spike_change
+        self.spike_symmetry = spike_symmetry
+        self.jump_change = jump_change
+        self.jump_persistence = jump_persistence
+        self.constant_tolerance = constant_tolerance
+        self.constant_hours = constant_hours
+        self.low_quantile = low_quantile
+        self.plateau_quantile = plateau_quantile
+        self.max_gap_minutes = max_gap_minutes
+
+    def masks(self, minutes: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Flags every observation of a series.
+        :param minutes: Timestamps of the observations in minutes since the epoch
+        :type minutes: np.ndarray
+        :param values: Soil moisture of the observations, NaN where missing
+        :type values: np.ndarray
+        :return: The bitmask of the recomputed flags of each observation, \
+            see SoilMoistureFlag
+        :rtype: np.ndarray
+        """
+        masks = np.zeros(len(values), dtype=np.uint32)
+        valid = np.flatnonzero(np.isfinite(values))
+        minutes, values = minutes[valid], values[valid]
+        if len(values) < 3:
+            return masks
+
+        adjacent = np.diff(minutes) <= self.max_gap_minutes
+        delta = np.diff(values)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = np.abs(delta) / np.abs(values[:-1])
+            symmetry = np.abs(delta[1:] / delta[:-1])
+
+        # D06: a large change immediately reversed by a change of similar size
+        spikes = np.zeros(len(values), dtype=bool)
+        spikes[1:-1] = (
+            adjacent[:-1]
+            & adjacent[1:]
+            & (relative[:-1] > self.spike_change)
+            & (np.sign(delta[:-1]) == -np.sign(delta[1:]))
+            & (np.abs(symmetry - 1) <= self.spike_symmetry)
+        )
+
+        # D07/D08: a large change the following observations do not reverse
+        following = np.lib.stride_tricks.sliding_window_view(
+            np.concatenate([values[1:], np.full(self.jump_persistence - 1, np.nan)]),
+            self.jump_persistence,
+        )
+        held = np.all(
+            (following - values[:-1, None]) * np.sign(delta)[:, None]
+            >= 0.5 * np.abs(delta)[:, None],
+            axis=1,
+        )
+        # neither the rise towards a spike nor the fall right after it is a jump
+        jumps = adjacent & (relative > self.jump_change) & held
+        jumps &= ~spikes[1:] & ~spikes[:-1]
+
+        # D09/D10: constant periods of a minimum duration at the low or high end
+        constant = np.diff(
+            np.concatenate(
+                ([0], adjacent & (np.abs(delta) <= self.constant_tolerance), [0])
+            ).astype(np.int8)
+        )
+        starts, stops = np.flatnonzero(constant == 1), np.flatnonzero(constant == -1)
+        lasting = minutes[stops] - minutes[starts] >= self.constant_hours * 60
+        low_value, plateau_value = np.quantile(
+            values, [self.low_quantile, self.plateau_quantile]
+        )
+
+        def within(periods: np.ndarray) -> np.ndarray:
+            marks = np.zeros(len(values) + 1, dtype=np.int64)
+            np.add.at(marks, starts[periods], 1)
+            np.add.at(marks, stops[periods] + 1, -1)
+            return np.cumsum(marks[:-1]) > 0
+
+        detected = {
+            "D06": spikes,
+            "D07": np.concatenate(([False], jumps & (delta < 0))),
+            "D08": np.concatenate(([False], jumps & (delta > 0))),
+            "D09": within(lasting & (values[starts] <= low_value)),
+            "D10": within(lasting & (values[starts] >= plateau_value)),
+        }
+        valid_masks = np.zeros(len(values), dtype=np.uint32)
+        for flag, observations in detected.items():
+            valid_masks[observations] |= SoilMoistureFlag(flag).mask
+        masks[valid] = valid_masks
+
+        return masks
+
+
+def spectrum_flag_counter(sensor_path, qc: SpectrumQC) -> tuple[str, np.ndarray]:
+    """Recomputes the spectrum based flags of one sensor and counts them.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :param qc: The spectrum based checks to be applied
+    :type qc: SpectrumQC
+    :return: The sensor path and the number of occurrences of every flag of \
+        SpectrumQC.flags
+    :rtype: tuple[str, np.ndarray]
+    """
+    df = series_reader(sensor_source(sensor_path))
+    masks = qc.masks(epoch_minutes(df), df.to_series(2).to_numpy())
+    return sensor_path, np.array(
+        [np.count_nonzero(masks & SoilMoistureFlag(flag).mask) for flag in qc.flags]
+    )
+
+
+def asof_values(
+    minutes: np.ndarray,
+    other_minutes: np.ndarray,
+    other_values: np.ndarray,
+    tolerance_minutes: int,
+) -> np.ndarray:
+    """Backward as-of join: picks for every timestamp the last value of another \
+        series observed at or before it, within a tolerance.
+    :param minutes: Timestamps to be matched, in minutes since the epoch
+    :type minutes: np.ndarray
+    :param other_minutes: Sorted timestamps of the other series
+    :type other_minutes: np.ndarray
+    :param other_values: Values of the other series
+    :type other_values: np.ndarray
+    :param tolerance_minutes: Maximum age of a matched value
+    :type tolerance_minutes: int
+    :return: The matched values, NaN where nothing was observed within the tolerance
+    :rtype: np.ndarray
+    """
+    if len(other_minutes) == 0:
+        return np.full(len(minutes), np.nan)
+
+    i = np.searchsorted(other_minutes, minutes, side="right") - 1
+    matched = (i >= 0) & (
+        minutes - other_minutes[np.maximum(i, 0)] <= tolerance_minutes
+    )
+    return np.where(matched, other_values[np.maximum(i, 0)], np.nan)
+
+
+def read_series(sensor_path) -> tuple[np.ndarray, np.ndarray]:
+    """Reads the timestamps and the valid values of one sensor, in time order.
+    :param sensor_path: Path to the .stm file of the sensor
+    :type sensor_path: str
+    :return: Minutes since the epoch and values of the non-missing observations
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    df = series_reader(sensor_source(sensor_path))
+    minutes, values = epoch_minutes(df), df.to_series(2).to_numpy()
+    valid = np.isfinite(values)
+    order = np.argsort(minutes[valid], kind="stable")
+    return minutes[valid][order], values[valid][order]
+
+
+def geophysical_flag_counter(
+    station: tuple,
+    tolerance_minutes: int,
+    freezing_point: float,
+    max_depth_difference: float,
+) -> list:
+    """Recomputes D01 and D02 for the soil moisture sensors of one station by \
+        as-of joining them with the soil temperature at the corresponding depth \
+        and with the air temperature.
+    :param station: The (sensor ID, path, depthfrom, depthto) of the soil moisture, \
+        soil temperature and air temperature sensors of the station
+    :type station: tuple
+    :param tolerance_minutes: Maximum age of a matched temperature
+    :type tolerance_minutes: int
+    :param freezing_point: Temperatures below are freezing, in °C
+    :type freezing_point: float
+    :param max_depth_difference: The largest distance in m between the layer \
+        centres of a soil moisture and a soil temperature sensor whose layers do \
+        not overlap, for the latter to count as the corresponding depth
+    :type max_depth_difference: float
+    :return: The sensor ID and the number of D01 and D02 occurrences of every soil \
+        moisture sensor
+    :rtype: list
+    """
+    soil_moisture, soil_temperature, air_temperature = station
+    air = read_series(air_temperature[0][1]) if air_temperature else None
+
+    counts = []
+    for sensor_id, sensor_path, depth_from, depth_to in soil_moisture:
+        minutes, _ = read_series(sensor_path)
+        d01 = d02 = 0
+        corresponding = [
+            ts
+            for ts in soil_temperature or []
+            if (ts[2] <= depth_to and ts[3] >= depth_from)
+            or abs((ts[2] + ts[3]) - (depth_from + depth_to)) / 2
+            <= max_depth_difference
+        ]
+        if corresponding:
+            # the temperature sensor whose layer centre is closest
+            _, ts_path, *_ = min(
+                corresponding,
+                key=lambda ts: abs((ts[2] + ts[3]) - (depth_from + depth_to)),
+            )
+            temperature = asof_values(minutes, *read_series(ts_path), tolerance_minutes)
+            d01 = int(np.count_nonzero(temperature < freezing_point))
+        if air is not None:
+            temperature = asof_values(minutes, *air, tolerance_minutes)
+            d02 = int(np.count_nonzero(temperature < freezing_point))
+        counts.append((sensor_id, [d01, d02]))
+
+    return counts
+
+
 class FunWithFlags(Flags, DataReader):
     """Small class centered around flags of the ISMN databse.
     Concerning soil moisture, following flags exist:
@@ -0,0 +1,37 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+DATABASE = "SYNTHETIC"
+SCALE = dict(n_networks=2, n_stations=2, n_hours=24 * 30, seed=1)
+
+
+@pytest.fixture(scope="session")
+def synthetic_archive(tmp_path_factory):
+    """A small synthetic database, as a directory and as a zip archive, built once."""
+    root = tmp_path_factory.mktemp("archive")
+    benchmark.make_synthetic_archive(str(root / DATABASE), zip_archive=True, **SCALE)
+    return root
+
+
+@pytest.fixture
+def database(synthetic_archive, tmp_path, monkeypatch):
+    """A fresh copy of the synthetic database directory in the working directory, \
+        as "Flags" and its artifacts are relative to it."""
+    shutil.copytree(synthetic_archive / DATABASE, tmp_path / DATABASE)
+    monkeypatch.chdir(tmp_path)
+    return DATABASE
+
+
+@pytest.fixture
+def zip_database(synthetic_archive, tmp_path, monkeypatch):
+    """A fresh copy of the synthetic zip archive in the working directory."""
+    shutil.copy(synthetic_archive / f"{DATABASE}.zip", tmp_path / f"{DATABASE}.zip")
+    monkeypatch.chdir(tmp_path)
+    return f"{DATABASE}.zip"
@@ -0,0 +1,107 @@
+import glob
+import os
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+import myismn
+
+
+def count_flags_directly(flags: myismn.Flags) -> pd.DataFrame:
+    counts = {}
+    for sensor_path in flags.get_all_sensors():
+        with open(sensor_path) as stm_file:
+            next(stm_file)
+            counter = Counter(
+                code for line in stm_file for code in line.split()[3].split(",")
+            )
+        sensor_id = flags.sensor_path_to_id_dict[flags.sensor_key(sensor_path)]
+        counts[sensor_id] = counter
+    return pd.DataFrame.from_dict(counts, orient="index").fillna(0).astype("int64")
+
+
+def test_flag_df_matches_a_direct_count(database):
+    flags = myismn.Flags(database)
+    flag_df = flags.get_flag_df(n_cores=2, backend="serial")
+
+    expected = count_flags_directly(flags)
+    expected = expected.reindex(index=flag_df.index, columns=flag_df.columns)
+    pd.testing.assert_frame_equal(
+        flag_df, expected.fillna(0).astype("int64"), check_names=False
+    )
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(streaming=False),
+        dict(streaming=True, max_memory_mb=1),
+        dict(streaming=True, io_threads=2, queue_depth=1, max_memory_mb=1),
+    ],
+)
+def test_readers_agree(database, options):
+    reference = myismn.Flags(database).get_flag_df(n_cores=2, backend="serial")
+    for path in glob.glob(os.path.join(database, "json_dicts", "flag_df*")):
+        if os.path.isfile(path):
+            os.remove(path)
+        else:
+            for checkpoint in os.listdir(path):
+                os.remove(os.path.join(path, checkpoint))
+
+    flag_df = myismn.Flags(database).get_flag_df(
+        n_cores=2, backend="threads", **options
+    )
+    pd.testing.assert_frame_equal(flag_df, reference)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resumes_from_checkpoints(database, monkeypatch):
+    flag_df = myismn.Flags(database).get_flag_df(n_cores=2, backend="serial")
+    json_dicts = os.path.join(database, "json_dicts")
+    os.remove(os.path.join(json_dicts, "flag_df.pkl"))
+    os.remove(os.path.join(json_dicts, "flag_df.arrow"))
+
+    # abort the run right after the first network is checkpointed
+    atomic_arrow = myismn.Tools.atomic_arrow
+
+    def interrupting_atomic_arrow(self, df, path):
+        atomic_arrow(self, df, path)
+        if "flag_df_checkpoints" in path:
+            raise Interrupted
+
+    with monkeypatch.context() as patch:
+        patch.setattr(myismn.Tools, "atomic_arrow", interrupting_atomic_arrow)
+        with pytest.raises(Interrupted):
+            myismn.Flags(database).get_flag_df(n_cores=2, backend="serial")
+    checkpoints = os.listdir(os.path.join(json_dicts, "flag_df_checkpoints"))
+    assert len(checkpoints) == 1
+
+    read = []
+    flag_batch_counter = myismn.flag_batch_counter
+
+    def recording_counter(batch):
+        read.extend(batch)
+        return flag_batch_counter(batch)
+
+    monkeypatch.setattr(myismn, "flag_batch_counter", recording_counter)
+    flags = myismn.Flags(database)
+    resumed = flags.get_flag_df(n_cores=2, backend="serial")
+
+    pd.testing.assert_frame_equal(resumed, flag_df)
+    checkpointed = os.path.splitext(checkpoints[0])[0]
+    assert {flags.get_path_segments(path)[-3] for path in read} == (
+        {"NET000", "NET001"} - {checkpointed}
+    )
+    assert not os.path.exists(os.path.join(json_dicts, "flag_df_checkpoints"))
+
+
+def test_cached_flag_df_is_loaded(database):
+    flag_df = myismn.Flags(database).get_flag_df(n_cores=2, backend="serial")
+    flags = myismn.Flags(database)
+    pd.testing.assert_frame_equal(flags.get_flag_df(), flag_df)
+    assert flags.flag_pl.columns[0] == "sensor_id"
+    assert flags.flag_pl.height == len(flag_df)
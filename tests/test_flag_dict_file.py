@@ -0,0 +1,97 @@
+import json
+import os
+from collections import defaultdict
+
+import pytest
+
+import myismn
+
+
+@pytest.fixture
+def flag_dict():
+    return {
+        "NET000": {
+            "Station0000": {
+                "sensor_a": {"G": 120, "D06": 3},
+                "sensor_b": {"G": 99},
+            },
+            "Station0001": {"sensor_c": {"C01": 1, "M": 7}},
+        },
+        "NÉT-ü": {"Station0000": {"sensor_d": {}}},
+        "NET002": {},
+    }
+
+
+def test_round_trip(flag_dict, tmp_path):
+    path = str(tmp_path / "flag_dict.bin")
+    myismn.write_flag_dict(flag_dict, path)
+
+    flag_dict_file = myismn.FlagDictFile(path)
+    assert flag_dict_file.load() == flag_dict
+    assert list(flag_dict_file) == list(flag_dict)
+    assert len(flag_dict_file) == 3
+    assert dict(flag_dict_file) == flag_dict
+    assert flag_dict_file.load_network("NÉT-ü") == flag_dict["NÉT-ü"]
+    assert flag_dict_file.load_network("NET002") == {}
+    assert flag_dict_file.load_station("NET000", "Station0001") == (
+        flag_dict["NET000"]["Station0001"]
+    )
+
+
+def test_stations_are_read_on_their_own(flag_dict, tmp_path):
+    path = str(tmp_path / "flag_dict.bin")
+    myismn.write_flag_dict(flag_dict, path)
+    flag_dict_file = myismn.FlagDictFile(path)
+
+    # a damaged block of another station does not affect the requested one
+    i = flag_dict_file.stations[("NET000", "Station0000")]
+    with open(path, "r+b") as bin_file:
+        bin_file.seek(flag_dict_file.data_offset + flag_dict_file.block_offsets[i])
+        bin_file.write(b"\x00" * 8)
+
+    assert flag_dict_file.load_station("NET000", "Station0001") == (
+        flag_dict["NET000"]["Station0001"]
+    )
+    with pytest.raises(Exception):
+        flag_dict_file.load_station("NET000", "Station0000")
+
+
+def test_nested_defaultdicts_are_written_as_dicts(tmp_path):
+    flag_dict = defaultdict(lambda: defaultdict(dict))
+    flag_dict["NET000"]["Station0000"]["sensor_a"] = {"G": 3}
+    path = str(tmp_path / "flag_dict.bin")
+    myismn.write_flag_dict(flag_dict, path)
+
+    loaded = myismn.FlagDictFile(path).load()
+    assert loaded == {"NET000": {"Station0000": {"sensor_a": {"G": 3}}}}
+    assert type(loaded["NET000"]) is dict
+
+
+def test_empty_and_invalid_files(tmp_path):
+    path = str(tmp_path / "flag_dict.bin")
+    myismn.write_flag_dict({}, path)
+    assert myismn.FlagDictFile(path).load() == {}
+
+    flag_dict_file = myismn.FlagDictFile(path)
+    with pytest.raises(KeyError):
+        flag_dict_file.load_network("NET000")
+    with pytest.raises(KeyError):
+        flag_dict_file.load_station("NET000", "Station0000")
+
+    json_path = str(tmp_path / "flag_dict.json")
+    with open(json_path, "w") as json_file:
+        json.dump({}, json_file)
+    with pytest.raises(ValueError):
+        myismn.FlagDictFile(json_path)
+
+
+def test_make_flag_dict_writes_and_reloads_the_binary_file(database):
+    flags = myismn.Flags(database)
+    flags.make_flag_dict(n_cores=2)
+    flag_dict = json.loads(json.dumps(flags.flag_dict))
+    assert os.path.isfile(os.path.join(database, "json_dicts", "flag_dict.bin"))
+
+    reloaded = myismn.Flags(database)
+    reloaded.make_flag_dict(n_cores=2)
+    assert isinstance(reloaded.flag_dict, myismn.FlagDictFile)
+    assert reloaded.flag_dict.load() == flag_dict
@@ -0,0 +1,99 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import myismn
+
+
+def test_encode_flag_runs_splits_on_changes_and_gaps():
+    minutes = np.array([0, 60, 120, 180, 240, 600, 660], dtype=np.int64)
+    masks = np.array([1, 1, 2, 2, 2, 2, 1], dtype=np.uint32)
+
+    starts, ends, run_masks = myismn.encode_flag_runs(minutes, masks)
+
+    assert starts.tolist() == [0, 120, 600, 660]
+    assert ends.tolist() == [120, 300, 660, 720]
+    assert run_masks.tolist() == [1, 2, 2, 1]
+
+
+def flagged_hours(sensor_path: str, flag: str, start=None, end=None) -> int:
+    """Counts the hourly observations carrying the flag, the independent reference."""
+    data = pd.read_csv(
+        sensor_path, sep=" ", skiprows=1, header=None, usecols=[0, 1, 3], dtype=str
+    )
+    times = pd.to_datetime(data[0] + " " + data[1], format="%Y/%m/%d %H:%M")
+    bit = myismn.SoilMoistureFlag(flag).mask
+    flagged = np.array(
+        [bool(myismn.parse_flag_string(flags)[0] & bit) for flags in data[3]]
+    )
+    if start is not None:
+        flagged &= (times >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        flagged &= (times < pd.Timestamp(end)).to_numpy()
+    return int(flagged.sum())
+
+
+@pytest.fixture
+def timelines(database):
+    flags = myismn.Flags(database)
+    return flags, flags.make_quality_timelines(n_cores=2, backend="serial")
+
+
+def test_flagged_duration_matches_the_observations(timelines):
+    flags, quality_timelines = timelines
+    assert len(quality_timelines.sensor_ids) == len(flags.get_all_sensors())
+
+    start, end = "2015-01-05 06:00", "2015-01-12 18:00"
+    for sensor_path in flags.get_all_sensors()[:6]:
+        sensor_id = flags.sensor_path_to_id_dict[flags.sensor_key(sensor_path)]
+        for flag in ["G", "D06"]:
+            assert quality_timelines.flagged_duration(
+                sensor_id, [flag]
+            ) == datetime.timedelta(hours=flagged_hours(sensor_path, flag))
+            assert quality_timelines.flagged_duration(
+                sensor_id, [flag], start, end
+            ) == datetime.timedelta(hours=flagged_hours(sensor_path, flag, start, end))
+
+
+def test_range_queries_are_clipped_to_the_period(timelines):
+    flags, quality_timelines = timelines
+    sensor_id = quality_timelines.sensor_ids[0]
+    start = datetime.datetime(2015, 1, 3, 12)
+    end = datetime.datetime(2015, 1, 9)
+
+    intervals = quality_timelines.flagged_intervals(sensor_id, ["G"], start, end)
+    assert intervals
+    assert all(start <= first < last <= end for first, last in intervals)
+    # runs are merged, so consecutive intervals never touch
+    assert all(
+        previous[1] < following[0]
+        for previous, following in zip(intervals, intervals[1:])
+    )
+    assert sum(
+        (last - first for first, last in intervals), datetime.timedelta()
+    ) == quality_timelines.flagged_duration(sensor_id, ["G"], start, end)
+
+    first, last, duration = quality_timelines.longest_run(sensor_id, ["G"], start, end)
+    assert duration == last - first == max(last - first for first, last in intervals)
+    assert quality_timelines.longest_run(sensor_id, ["G"], end, end) is None
+
+
+def test_unknown_sensors_and_flags_are_rejected(timelines):
+    _, quality_timelines = timelines
+    with pytest.raises(KeyError):
+        quality_timelines.flagged_duration("n999s9999d99999", ["G"])
+    with pytest.raises(ValueError):
+        quality_timelines.flag_mask(["X99"])
+
+
+def test_no_sensors_give_empty_timelines(database, monkeypatch):
+    flags = myismn.Flags(database)
+    flags.make_sensor_ids(n_cores=2, backend="serial")
+    monkeypatch.setattr(flags, "get_all_sensors", lambda: [])
+
+    quality_timelines = flags.make_quality_timelines(n_cores=2, backend="serial")
+    assert quality_timelines.sensor_ids == []
+    assert len(quality_timelines.starts) == 0
+    assert quality_timelines.offsets.tolist() == [0]
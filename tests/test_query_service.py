@@ -0,0 +1,132 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import polars as pl
+import pytest
+
+import myismn
+
+
+@pytest.fixture
+def service(database):
+    flags = myismn.Flags(database)
+    flag_df = flags.get_flag_df(n_cores=2, backend="serial")
+    return myismn.QueryService(database), flag_df
+
+
+def get(service: myismn.QueryService, url: str, method: str = "GET"):
+    status, content_type, body = service.handle(method, url)
+    if content_type == "application/json":
+        return status, json.loads(body)
+    return status, body
+
+
+def test_status_and_lookups(service):
+    service, flag_df = service
+    status, response = get(service, "/status")
+    assert status == 200
+    assert response["sensors"] == len(flag_df)
+    assert response["networks"] == 2
+    assert response["flags"] == list(flag_df.columns)
+
+    sensor_id = flag_df.index[0]
+    status, response = get(service, f"/sensors/{sensor_id}")
+    assert status == 200
+    assert response["sensor_id"] == sensor_id
+    assert response["counts"] == {
+        flag: int(count) for flag, count in flag_df.loc[sensor_id].items()
+    }
+    assert response["total"] == int(flag_df.loc[sensor_id].sum())
+
+    status, response = get(service, "/networks/NET001")
+    assert status == 200
+    assert response["n_sensors"] == len(flag_df) // 2
+
+    status, response = get(service, "/sensors?network=NET000&station=Station0001")
+    assert status == 200
+    assert {row["network"] for row in response} == {"NET000"}
+    assert {row["station"] for row in response} == {"Station0001"}
+    assert len(response) == len(flag_df) // 4
+
+
+def test_tables_as_arrow(service):
+    service, flag_df = service
+    status, body = get(service, "/networks?format=arrow")
+    assert status == 200
+    table = pl.read_ipc(io.BytesIO(body))
+    assert sorted(table["network"].to_list()) == ["NET000", "NET001"]
+    assert table["n_sensors"].sum() == len(flag_df)
+
+
+def test_filter_and_top_k(service):
+    service, flag_df = service
+    fractions = flag_df.div(flag_df.sum(axis=1), axis=0)
+
+    status, response = get(service, "/filter?G=>0.5&D06=<=0.05")
+    assert status == 200
+    expected = fractions[(fractions["G"] > 0.5) & (fractions["D06"] <= 0.05)]
+    assert [row["sensor_id"] for row in response] == expected.index.tolist()
+
+    status, response = get(service, "/top?flag=G&k=5&network=NET000")
+    assert status == 200
+    in_network = fractions[flag_df.index.str.startswith("n001")]
+    expected = (
+        in_network.rename_axis("sensor_id")
+        .reset_index()
+        .sort_values(["G", "sensor_id"], ascending=[False, True])
+    )
+    assert [row["sensor_id"] for row in response] == expected["sensor_id"][:5].tolist()
+    assert response[0]["fraction_G"] == pytest.approx(expected["G"].iloc[0])
+
+
+@pytest.mark.parametrize(
+    "method, url, status",
+    [
+        ("GET", "/sensors/n999s9999d99999", 404),
+        ("GET", "/networks/NOPE", 404),
+        ("GET", "/nothing", 404),
+        ("GET", "/top?k=3", 400),
+        ("GET", "/top?flag=G&k=-1", 400),
+        ("GET", "/top?flag=G&k=two", 400),
+        ("GET", "/top?flag=X99", 400),
+        ("GET", "/filter?G=~0.5", 400),
+        ("GET", "/sensors?region=alps", 200),
+        ("POST", "/status", 405),
+    ],
+)
+def test_errors(service, method, url, status):
+    service, _ = service
+    response_status, response = get(service, url, method)
+    assert response_status == status
+    if status != 200:
+        assert "error" in response
+
+
+def test_reload(service):
+    service, flag_df = service
+    loaded_at = service.status()["loaded_at"]
+    status, response = get(service, "/reload", "POST")
+    assert status == 200
+    assert response["sensors"] == len(flag_df)
+    assert response["loaded_at"] >= loaded_at
+
+
+def test_http_server(service):
+    service, flag_df = service
+    server = service.make_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/status") as response:
+            assert response.status == 200
+            assert json.load(response)["sensors"] == len(flag_df)
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/sensors/unknown")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,76 @@
+import glob
+import os
+import shutil
+
+import myismn
+from conftest import DATABASE
+
+
+def sensor_file(database: str, variable: str, sensor: str, station: str) -> str:
+    (path,) = glob.glob(
+        os.path.join(database, "NET000", station, f"*_{variable}_*_{sensor}_*.stm")
+    )
+    return path
+
+
+def test_snapshot_diff_classifies_every_sensor(database):
+    new_database = f"{DATABASE}_NEW"
+    shutil.copytree(database, new_database)
+
+    removed = sensor_file(new_database, "ta", "Probe-4", "Station0000")
+    os.remove(removed)
+
+    # one more day at the end of the record, the file named after its new end date
+    extended = sensor_file(new_database, "sm", "Probe-0", "Station0000")
+    with open(extended) as stm_file:
+        lines = stm_file.read().splitlines()
+    date, time = lines[-1].split()[:2]
+    last_day = myismn.datetime.datetime.strptime(date, "%Y/%m/%d")
+    next_day = last_day + myismn.datetime.timedelta(days=1)
+    with open(extended, "a") as stm_file:
+        stm_file.write(f"{next_day:%Y/%m/%d} {time} 0.2500 D06 M\n")
+    segments = os.path.basename(extended).split("_")
+    segments[-1] = f"{next_day:%Y%m%d}.stm"
+    os.rename(extended, os.path.join(os.path.dirname(extended), "_".join(segments)))
+
+    # the same size, but another flag in the middle of the record
+    modified = sensor_file(new_database, "sm", "Probe-1", "Station0001")
+    with open(modified) as stm_file:
+        lines = stm_file.read().splitlines()
+    middle = len(lines) // 2
+    date, time, value, flag, original_flag = lines[middle].split()
+    replacement = "C01" if flag != "C01" else "C02"
+    lines[middle] = " ".join([date, time, value, replacement, original_flag])
+    with open(modified, "w") as stm_file:
+        stm_file.write("\n".join(lines) + "\n")
+
+    added = sensor_file(new_database, "sm", "Probe-2", "Station0001").replace(
+        "Probe-2", "Probe-9"
+    )
+    shutil.copy(sensor_file(new_database, "sm", "Probe-2", "Station0001"), added)
+
+    diff = myismn.SnapshotDiff(database, new_database)
+    diff_df = diff.diff(n_cores=2, backend="serial")
+
+    def row(station: str, sensor: str):
+        rows = diff_df[
+            (diff_df["network"] == "NET000")
+            & (diff_df["station"] == station)
+            & (diff_df["sensorname"] == sensor)
+        ]
+        assert len(rows) == 1
+        return rows.iloc[0]
+
+    assert row("Station0000", "Probe-4")["status"] == "removed"
+    assert row("Station0000", "Probe-0")["status"] == "extended"
+    assert row("Station0000", "Probe-0")["D06"] == 1
+    assert row("Station0001", "Probe-1")["status"] == "modified"
+    assert row("Station0001", "Probe-1")[replacement] == 1
+    if flag in diff.flags:
+        assert row("Station0001", "Probe-1")[flag] == -1
+    assert row("Station0001", "Probe-9")["status"] == "added"
+    assert row("Station0001", "Probe-9")["G"] > 0
+
+    unchanged = diff_df["status"] == "unchanged"
+    assert (~unchanged).sum() == 4
+    assert (diff_df.loc[unchanged, diff.flags] == 0).all().all()
@@ -0,0 +1,39 @@
+import os
+import shutil
+
+import pandas as pd
+
+import myismn
+from conftest import DATABASE
+
+
+def test_zip_archive_matches_the_directory(synthetic_archive, zip_database):
+    archive = myismn.Flags(zip_database)
+    assert archive.archive == os.path.abspath(zip_database)
+    assert archive.database_name == DATABASE
+    zip_flag_df = archive.get_flag_df(n_cores=2, backend="serial")
+    zip_sensor_df = archive.sensor_df
+
+    # the extracted database gets the same name, so it is read in its own directory
+    os.remove(zip_database)
+    shutil.rmtree(DATABASE)
+    shutil.copytree(synthetic_archive / DATABASE, DATABASE)
+    directory = myismn.Flags(DATABASE)
+    flag_df = directory.get_flag_df(n_cores=2, backend="serial")
+
+    assert len(archive.get_archive_sensors()) == len(directory.get_all_sensors())
+    pd.testing.assert_frame_equal(zip_flag_df, flag_df)
+    pd.testing.assert_frame_equal(zip_sensor_df, directory.sensor_df)
+
+
+def test_sensor_key_is_independent_of_the_container(synthetic_archive, zip_database):
+    archive = myismn.Flags(zip_database)
+    sensor_path = archive.get_all_sensors()[0]
+    network, station, filename = archive.get_path_segments(sensor_path)[-3:]
+
+    assert sensor_path.startswith(os.path.abspath(zip_database))
+    assert archive.sensor_key(sensor_path) == "/".join(
+        [DATABASE, network, station, filename]
+    )
+    with open(synthetic_archive / DATABASE / network / station / filename, "rb") as stm:
+        assert myismn.read_sensor_file(sensor_path) == stm.read()